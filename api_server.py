@@ -0,0 +1,266 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from batch_gpa import MAX_HOUR, MAX_MARK, MIN_HOUR, MIN_MARK, weighted_gpa
+from estimation import FINAL_MARK, estimate_final_gpa, simulate_final_gpa, make_rng
+from grade_store import save_grades, save_marks_hours
+
+# Estimate requests arriving within this window are sent to the pool together
+BATCH_WINDOW = 0.005
+BATCH_MAX = 64
+
+# Largest request body accepted, in bytes
+MAX_BODY = 8 * 1024 * 1024
+
+# Most simulated draws one estimate request may ask for (the Analytics limit)
+MAX_DRAWS = 1000000
+
+# Most mistakes a final can have: the largest final mark
+MAX_MISTAKES = max(FINAL_MARK.values())
+
+# Errors raised by a malformed payload, answered with 400
+BAD_REQUEST_ERRORS = (KeyError, TypeError, ValueError, OverflowError)
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error'}
+
+
+def _matrix(payload, key):
+    values = np.atleast_2d(np.asarray(payload[key], dtype=float))
+    if values.size == 0:
+        raise ValueError(f"'{key}' is empty.")
+    return values
+
+
+def _hours(payload, count):
+    hours = np.asarray(payload['hours'], dtype=float)
+    if hours.shape != (count,):
+        raise ValueError(f"'hours' must have one value per subject ({count}).")
+    if ((hours < MIN_HOUR) | (hours > MAX_HOUR)).any():
+        raise ValueError(f"Hours must be between {MIN_HOUR} and {MAX_HOUR}.")
+    return hours
+
+
+def _marks(payload, key):
+    marks = _matrix(payload, key)
+    if ((marks < MIN_MARK) | (marks > MAX_MARK)).any():
+        raise ValueError(f"Marks must be between {MIN_MARK} and {MAX_MARK}.")
+    return marks
+
+
+# POST /gpa {"marks": [...] or [[...], ...], "hours": [...]}
+def gpa_response(payload):
+    marks = _marks(payload, 'marks')
+    hours = _hours(payload, marks.shape[1])
+    return {'gpa': weighted_gpa(marks, hours).tolist()}
+
+
+# POST /estimate {"grades": [[...], ...], "hours": [...], "subjects": [...],
+#                 "subjects_for_50": [...], "start": 0, "finish": 5,
+#                 "seed": 0, "draws": 0, "goal": 90}
+def estimate_response(payload):
+    grades = _marks(payload, 'grades')
+    hours = _hours(payload, grades.shape[1])
+    subjects = payload.get('subjects', [])
+    f5_mask = np.isin(subjects, payload.get('subjects_for_50', [])) if subjects else np.zeros(len(hours), bool)
+    if len(f5_mask) != len(hours):
+        raise ValueError("'subjects' must have one name per subject.")
+    start, finish = int(payload.get('start', 0)), int(payload.get('finish', 1))
+    if not 0 <= start <= finish <= MAX_MISTAKES:
+        raise ValueError(f"'start' and 'finish' must satisfy 0 <= start <= finish <= {MAX_MISTAKES}.")
+    rng = make_rng(payload.get('seed'))
+
+    draws = int(payload.get('draws', 0))
+    if not 0 <= draws <= MAX_DRAWS:
+        raise ValueError(f"'draws' must be between 0 and {MAX_DRAWS}.")
+    if not draws:
+        return {'gpa': estimate_final_gpa(grades, hours, f5_mask, start, finish, rng).tolist()}
+
+    result = simulate_final_gpa(grades, hours, f5_mask, start, finish, float(payload.get('goal', 90)), draws,
+                                rng=rng)
+    response = {'mean': result['mean'].tolist(), 'goal_probability': result['goal_probability'].tolist()}
+    for p, values in result['percentiles'].items():
+        response[f'p{p}'] = values.tolist()
+    return response
+
+
+# Runs in a worker process: one call per batch of estimate requests. A
+# payload that fails only fails its own request, not the rest of the batch.
+def estimate_batch(payloads):
+    results = []
+    for payload in payloads:
+        try:
+            results.append((200, estimate_response(payload)))
+        except BAD_REQUEST_ERRORS as e:
+            results.append((400, {'error': str(e)}))
+        except Exception as e:
+            results.append((500, {'error': str(e)}))
+    return results
+
+
+# Whole numbers as int, so integer marks stay integers in the CSV files
+def _plain(values):
+    return [int(value) if value == int(value) else value for value in values.tolist()]
+
+
+# POST /snapshots {"subjects": [...], "marks": [...], "hours": [...], "student": "..."}
+# Everything is checked before the first of the two histories is written.
+def save_snapshot(payload):
+    subjects = payload['subjects']
+    if not isinstance(subjects, list) or not all(isinstance(subject, str) for subject in subjects):
+        raise ValueError("'subjects' must be a list of names.")
+    student = payload.get('student')
+    if student is not None and not isinstance(student, str):
+        raise ValueError("'student' must be a name.")
+    if np.asarray(payload['marks'], dtype=float).ndim != 1:
+        raise ValueError("'marks' must be a single list of marks.")
+    marks = _marks(payload, 'marks')[0]
+    hours = _hours(payload, len(marks))
+    if len(subjects) != len(marks):
+        raise ValueError("'subjects' must have one name per mark.")
+    final_gpa = float(weighted_gpa(marks[None], hours)[0])
+    save_grades(subjects, _plain(marks), final_gpa, student=student)
+    save_marks_hours(subjects, _plain(marks), _plain(hours), student=student)
+    return {'gpa': final_gpa}
+
+
+class GPAServer:
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        # Workers are not forked from the server, so they never hold copies
+        # of its listening socket or of client connections
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        self.queue = None
+        self.slots = None
+        self.save_lock = None
+
+    # Collect estimate requests for a short window and send them as one job
+    async def batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.slots.acquire()
+            self.slots.release()
+            batch = [await self.queue.get()]
+            deadline = loop.time() + BATCH_WINDOW
+            while len(batch) < BATCH_MAX:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            asyncio.create_task(self.run_batch(batch))
+
+    # At most two batches per worker are in flight, the rest wait in the queue
+    async def run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            async with self.slots:
+                results = await loop.run_in_executor(self.pool, estimate_batch, [payload for payload, _ in batch])
+        except Exception as e:
+            results = [(500, {'error': str(e)})] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def dispatch(self, method, path, payload):
+        loop = asyncio.get_running_loop()
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path not in ('/gpa', '/estimate', '/snapshots'):
+            return 404, {'error': f'Unknown endpoint {path}'}
+        if method != 'POST':
+            return 405, {'error': 'Use POST'}
+
+        if path == '/gpa':
+            return 200, gpa_response(payload)
+        if path == '/estimate':
+            future = loop.create_future()
+            await self.queue.put((payload, future))
+            return await future
+        # Saves append to the shared CSV files, one at a time
+        async with self.save_lock:
+            return 200, await loop.run_in_executor(None, save_snapshot, payload)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                    lines = head.decode('latin-1').split('\r\n')
+                    method, path, version = lines[0].split(' ', 2)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY:
+                    status, body = 413, {'error': 'Request body too large'}
+                    keep_alive = False
+                else:
+                    data = await reader.readexactly(length) if length else b''
+                    keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                    try:
+                        payload = json.loads(data) if data else {}
+                        status, body = await self.dispatch(method, path.split('?', 1)[0], payload)
+                    except BAD_REQUEST_ERRORS as e:
+                        status, body = 400, {'error': str(e)}
+                    except Exception as e:
+                        status, body = 500, {'error': str(e)}
+
+                content = json.dumps(body).encode('utf-8')
+                writer.write(f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(content)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1')
+                             + content)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(2 * self.workers)
+        self.save_lock = asyncio.Lock()
+        # Start the workers before listening, so the first requests do not
+        # wait for them
+        await asyncio.gather(*(asyncio.get_running_loop().run_in_executor(self.pool, int)
+                               for _ in range(self.workers)))
+        batcher = asyncio.create_task(self.batcher())
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self.pool.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JSON API for GPA calculation, saving and final estimation.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--workers', type=int, default=None, help="Estimation worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(GPAServer(args.workers).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
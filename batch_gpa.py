@@ -0,0 +1,107 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# Rows parsed per chunk, memory stays flat whatever the roster size
+CHUNK_ROWS = 50000
+
+# Same bounds as the calculator form in main.py
+MIN_MARK, MAX_MARK = 0, 100
+MIN_HOUR, MAX_HOUR = 1, 12
+
+
+def load_preset(preset_path):
+    with open(preset_path) as f:
+        preset_data = json.load(f)
+    subjects = list(preset_data.get('subjects', []))
+    hours = np.asarray(preset_data.get('hours', []), dtype=float)
+    if len(subjects) != len(hours):
+        raise ValueError(f"{preset_path}: {len(subjects)} subjects but {len(hours)} hours.")
+    if ((hours < MIN_HOUR) | (hours > MAX_HOUR)).any():
+        raise ValueError(f"{preset_path}: hours must be between {MIN_HOUR} and {MAX_HOUR}.")
+    return subjects, hours
+
+
+# marks * hours / sum(hours) for every row of a (students, subjects) matrix
+def weighted_gpa(marks, hours):
+    hours = np.asarray(hours, dtype=float)
+    return np.asarray(marks, dtype=float) @ hours / hours.sum()
+
+
+# Rows with a missing or out of range mark get no GPA
+def valid_rows(marks):
+    return ((marks >= MIN_MARK) & (marks <= MAX_MARK)).all(axis=1)
+
+
+def roster_files(paths):
+    files = []
+    for path in paths:
+        files.extend(sorted(glob.glob(os.path.join(path, '*.csv'))) if os.path.isdir(path) else [path])
+    return files
+
+
+# Every non-subject column of a roster
+def roster_id_columns(roster_path, subjects):
+    return [column for column in pd.read_csv(roster_path, nrows=0).columns if column not in subjects]
+
+
+# Yield one result frame per roster chunk, with the given id columns (blank
+# where the roster has no such column)
+def compute_roster_gpas(roster_path, subjects, hours, id_columns=None, chunk_rows=CHUNK_ROWS):
+    header = list(pd.read_csv(roster_path, nrows=0).columns)
+    missing = [subject for subject in subjects if subject not in header]
+    if missing:
+        raise ValueError(f"{roster_path}: missing subject columns {missing}.")
+    if id_columns is None:
+        id_columns = roster_id_columns(roster_path, subjects)
+
+    roster_name = os.path.splitext(os.path.basename(roster_path))[0]
+    columns = set(id_columns + subjects)
+    for chunk in pd.read_csv(roster_path, usecols=lambda column: column in columns, chunksize=chunk_rows):
+        marks = chunk[subjects].to_numpy(dtype=float)
+        valid = valid_rows(marks)
+        result = chunk.reindex(columns=id_columns)
+        result.insert(0, 'Roster', roster_name)
+        result['GPA'] = np.where(valid, weighted_gpa(np.nan_to_num(marks), hours), np.nan)
+        yield result, int((~valid).sum())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute weighted GPAs for whole rosters from a class preset.")
+    parser.add_argument('preset', help="Class-Templates preset JSON file")
+    parser.add_argument('rosters', nargs='+', help="Roster CSV files or directories of them, one column per subject")
+    parser.add_argument('-o', '--output', help="Output CSV file (default: stdout)")
+    parser.add_argument('--id-column', action='append', dest='id_columns',
+                        help="Column identifying a student (default: every non-subject column of the first roster)")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    subjects, hours = load_preset(args.preset)
+    rosters = roster_files(args.rosters)
+    # One header for the whole output, so every roster is written under the same columns
+    id_columns = args.id_columns or (roster_id_columns(rosters[0], subjects) if rosters else [])
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    header = True
+    invalid = 0
+    try:
+        for roster_path in rosters:
+            for result, skipped in compute_roster_gpas(roster_path, subjects, hours, id_columns,
+                                                       args.chunk_rows):
+                result.to_csv(output, header=header, index=False)
+                header = False
+                invalid += skipped
+    finally:
+        if args.output:
+            output.close()
+
+    if invalid:
+        print(f"{invalid} rows had marks outside {MIN_MARK}-{MAX_MARK} and were left without a GPA.",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import precompute
+from grade_store import save_grades, save_marks_hours
+from run_benchmarks import synthetic_history
+
+
+# Render time of the Analytics page right after a save, with the results
+# computed on render (precompute off) or by the background worker (on).
+# The save itself is not timed; with precompute on the render starts once
+# the worker is done, as it would for someone opening the page a moment later.
+def measure(snapshots, subjects, saves):
+    from streamlit.testing.v1 import AppTest
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        _, names, hours = synthetic_history(os.path.join(directory, 'csv'), snapshots, subjects)
+        marks = [70] * len(names)
+        # Without the worker first: once started it stays subscribed to saves
+        for mode in (False, True):
+            precompute.PRECOMPUTE = mode
+            page = AppTest.from_file(os.path.join(ROOT, 'pages', 'Analytics.py'), default_timeout=120)
+            page.run()
+            times = []
+            for _ in range(saves):
+                save_grades(names, marks, 70.0)
+                save_marks_hours(names, marks, hours)
+                if mode:
+                    precompute.wait_idle()
+                started = time.perf_counter()
+                page.run()
+                times.append(time.perf_counter() - started)
+                if page.exception:
+                    raise RuntimeError(page.exception[0].message)
+            results['precompute on' if mode else 'precompute off'] = times
+        os.chdir(ROOT)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analytics page render time after a save, with and without "
+                                                 "the background precompute worker.")
+    parser.add_argument('--snapshots', type=int, default=100000)
+    parser.add_argument('--subjects', type=int, default=11)
+    parser.add_argument('--saves', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    for mode, times in measure(args.snapshots, args.subjects, args.saves).items():
+        print(f"{mode:16} median {statistics.median(times) * 1000:8.1f} ms   max {max(times) * 1000:8.1f} ms")
+    print(f"worker: {precompute.status()}")
+
+
+if __name__ == "__main__":
+    main()
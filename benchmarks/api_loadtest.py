@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+
+# Request bodies per endpoint, sized like one student's history
+SUBJECTS = ['Math', 'Physics', 'Chemistry', 'Biology', 'English', 'History', 'Arabic', 'Geography', 'Art',
+            'Computer', 'Religion']
+HOURS = [6, 4, 4, 4, 5, 2, 5, 2, 1, 2, 1]
+
+
+def request_body(endpoint, index, snapshots, draws):
+    rng = np.random.default_rng(index)
+    marks = rng.integers(60, 101, size=(snapshots, len(SUBJECTS))).tolist()
+    if endpoint == 'gpa':
+        return {'marks': marks, 'hours': HOURS}
+    return {'grades': marks, 'hours': HOURS, 'subjects': SUBJECTS, 'subjects_for_50': SUBJECTS[:3],
+            'start': 0, 'finish': 5, 'seed': index, 'draws': draws, 'goal': 90}
+
+
+# One keep-alive connection sending its share of the requests back to back
+async def client(host, port, endpoint, bodies, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for body in bodies:
+            content = json.dumps(body).encode('utf-8')
+            started = time.perf_counter()
+            writer.write(f"POST /{endpoint} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(content)}\r\n\r\n".encode('latin-1') + content)
+            await writer.drain()
+            head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+            length = 0
+            for line in head.split('\r\n')[1:]:
+                if line.lower().startswith('content-length:'):
+                    length = int(line.split(':', 1)[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            if not head.startswith('HTTP/1.1 200'):
+                errors.append(head.split('\r\n', 1)[0])
+    finally:
+        writer.close()
+
+
+async def run(host, port, endpoint, requests, concurrency, snapshots, draws):
+    bodies = [request_body(endpoint, i, snapshots, draws) for i in range(requests)]
+    latencies, errors = [], []
+    started = time.perf_counter()
+    await asyncio.gather(*[client(host, port, endpoint, bodies[i::concurrency], latencies, errors)
+                           for i in range(concurrency)])
+    return latencies, errors, time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test a running api_server.py.")
+    parser.add_argument('endpoint', nargs='?', default='estimate', help="gpa or estimate (default: estimate)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50, help="Keep-alive connections")
+    parser.add_argument('--snapshots', type=int, default=100, help="Grade snapshots per request")
+    parser.add_argument('--draws', type=int, default=0, help="Monte Carlo draws per estimate (0: single estimate)")
+    args = parser.parse_args(argv)
+    if args.endpoint not in ('gpa', 'estimate'):
+        parser.error("endpoint must be gpa or estimate")
+
+    latencies, errors, elapsed = asyncio.run(run(args.host, args.port, args.endpoint, args.requests,
+                                                 args.concurrency, args.snapshots, args.draws))
+    latencies = np.asarray(latencies) * 1000
+    print(f"{len(latencies)} requests to /{args.endpoint} over {args.concurrency} connections in {elapsed:.2f} s")
+    print(f"throughput {len(latencies) / elapsed:10.1f} req/s")
+    print(f"p50        {np.percentile(latencies, 50):10.2f} ms")
+    print(f"p99        {np.percentile(latencies, 99):10.2f} ms")
+    print(f"max        {latencies.max():10.2f} ms")
+    if errors:
+        print(f"{len(errors)} errors, first: {errors[0]}")
+
+
+if __name__ == "__main__":
+    main()
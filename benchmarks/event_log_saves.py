@@ -0,0 +1,89 @@
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import grade_store
+from batch_gpa import weighted_gpa
+from estimation import make_rng
+from grade_store import history_files, load_history, save_grades, save_marks_hours
+from event_log import checkpoints_path, log_path, snapshot
+from run_benchmarks import preset_subjects
+
+
+# Marks of a history where each save changes one mark, as the form is used
+def one_change_marks(snapshots, subjects, seed=0):
+    rng = make_rng(seed)
+    marks = np.empty((snapshots, subjects), dtype=int)
+    row = rng.integers(40, 101, size=subjects)
+    for i in range(snapshots):
+        row[rng.integers(subjects)] = rng.integers(40, 101)
+        marks[i] = row
+    return marks
+
+
+def history_bytes(file_path):
+    paths = history_files(file_path) + [log_path(file_path), checkpoints_path(file_path)]
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+# Saves the CSV files and the event logs take for the same history, the
+# bytes each adds, and how long loading the tables back takes
+def measure(snapshots, subjects, loads):
+    names, hours = preset_subjects(subjects)
+    marks = one_change_marks(snapshots, subjects)
+    gpas = weighted_gpa(marks, hours)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in ('csv', 'events'):
+            grade_store.STORAGE_BACKEND = backend
+            grades_path = os.path.join(directory, backend, 'grades', 'Grades.csv')
+            marks_hours_path = os.path.join(directory, backend, 'mark_hours', 'Marks_Hours.csv')
+            started = time.perf_counter()
+            for row, gpa in zip(marks.tolist(), gpas.tolist()):
+                save_grades(names, row, gpa, grades_path)
+                save_marks_hours(names, row, hours, marks_hours_path)
+            save_ms = (time.perf_counter() - started) * 1000 / snapshots
+            stored = history_bytes(grades_path) + history_bytes(marks_hours_path)
+
+            load_times = []
+            for _ in range(loads):
+                started = time.perf_counter()
+                load_history(grades_path)
+                load_history(marks_hours_path)
+                load_times.append(time.perf_counter() - started)
+            results[backend] = {
+                'save ms': save_ms,
+                'bytes per save': stored / snapshots,
+                'stored bytes': stored,
+                'load ms': statistics.median(load_times) * 1000,
+            }
+            if backend == 'events':
+                started = time.perf_counter()
+                snapshot(grades_path, snapshots // 2)
+                results[backend]['snapshot ms'] = (time.perf_counter() - started) * 1000
+        grade_store.STORAGE_BACKEND = 'csv'
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Storage, save and load time of the CSV histories against the "
+                                                 "per-column event logs, for saves that change one mark.")
+    parser.add_argument('--snapshots', type=int, default=5000)
+    parser.add_argument('--subjects', type=int, default=11)
+    parser.add_argument('--loads', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    for backend, result in measure(args.snapshots, args.subjects, args.loads).items():
+        print(f"{backend:7} " + '   '.join(f"{name} {value:,.2f}" for name, value in result.items()))
+
+
+if __name__ == "__main__":
+    main()
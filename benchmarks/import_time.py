@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules whose import dominates a cold start
+HEAVY_MODULES = ['pandas', 'numpy', 'plotly.graph_objects', 'pyarrow']
+
+# Code timed in a fresh interpreter per run. The AppTest import is kept out
+# of the timing, it is only the harness.
+SCENARIOS = {
+    'calculator import': "import main",
+    'calculator first render': "AppTest.from_file('GPA-Calculator.py', default_timeout=120).run()",
+    'analytics import': "sys.path.insert(0, 'pages'); import Analytics",
+}
+
+RUNNER = """
+import json, sys, time
+sys.path.insert(0, '.')
+from streamlit.testing.v1 import AppTest
+started = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+# Top-level imports by cumulative time, from the -X importtime lines
+# (without the harness's own AppTest import)
+def slowest_imports(stderr, top=5):
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not name.startswith('  ') and name.strip() != 'streamlit.testing.v1':
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def measure(repo, code, runs):
+    results = []
+    for _ in range(runs):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                                  RUNNER.format(code=code, heavy=HEAVY_MODULES)],
+                                 cwd=repo, capture_output=True, text=True)
+        if process.returncode != 0:
+            raise RuntimeError(process.stderr.strip().splitlines()[-1])
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        result['slowest'] = slowest_imports(process.stderr)
+        results.append(result)
+    return {
+        'seconds': statistics.median(result['seconds'] for result in results),
+        'loaded': results[-1]['loaded'],
+        'slowest': results[-1]['slowest'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold start import and first render times.")
+    parser.add_argument('scenarios', nargs='*', help=f"Scenarios: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument('--repo', default=ROOT, help="Checkout to measure, e.g. a git worktree of an older commit")
+    parser.add_argument('--runs', type=int, default=5, help="Fresh interpreters per scenario, the median is shown")
+    parser.add_argument('--details', action='store_true', help="Show the slowest top-level imports")
+    args = parser.parse_args(argv)
+    unknown = [scenario for scenario in args.scenarios if scenario not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios {unknown}")
+
+    for scenario in args.scenarios or SCENARIOS:
+        result = measure(args.repo, SCENARIOS[scenario], args.runs)
+        print(f"{scenario:30} {result['seconds'] * 1000:10.1f} ms   loads: {', '.join(result['loaded']) or '-'}")
+        if args.details:
+            for cumulative, name in result['slowest']:
+                print(f"{'':30} {cumulative / 1000:10.1f} ms   {name}")
+
+
+if __name__ == "__main__":
+    main()
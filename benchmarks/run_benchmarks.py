@@ -0,0 +1,210 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from batch_gpa import weighted_gpa
+from columnar_store import load_table
+from estimation import (calculate_final_gpa, estimate_final_gpa_series, final_exam_mark_estimation,
+                        simulate_final_gpa_series, make_rng)
+from grade_store import save_grades, save_marks_hours
+from scenario_sweep import scenario_table
+
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+# A benchmark is reported as a regression when it gets this much slower
+REGRESSION_RATIO = 1.25
+
+FULL_SIZES = {'snapshots': [10, 1000, 10000, 100000], 'subjects': [5, 11, 50], 'history': [0, 1000, 100000]}
+QUICK_SIZES = {'snapshots': [10, 1000], 'subjects': [5, 11], 'history': [0, 1000]}
+
+
+# Subject names and hours taken from the Class-Templates presets, cycled
+# (with a suffix) when more subjects are needed than a preset has
+def preset_subjects(count):
+    subjects, hours = [], []
+    for preset_path in sorted(glob.glob(os.path.join(ROOT, 'Class-Templates', '*.json'))):
+        with open(preset_path) as f:
+            preset_data = json.load(f)
+        subjects += preset_data['subjects']
+        hours += preset_data['hours']
+    names = [subjects[i % len(subjects)] + ('' if i < len(subjects) else f' {i // len(subjects)}')
+             for i in range(count)]
+    return names, [hours[i % len(hours)] for i in range(count)]
+
+
+def synthetic_history(directory, snapshots, subjects, seed=0):
+    rng = make_rng(seed)
+    names, hours = preset_subjects(subjects)
+    marks = rng.integers(40, 101, size=(snapshots, subjects))
+    grades_data = pd.DataFrame(marks, columns=names)
+    grades_data.insert(0, 'GPA', weighted_gpa(marks, hours))
+    grades_data.insert(0, 'Date/Time', pd.date_range('2020-01-01', periods=snapshots, freq='h').strftime('%Y-%m-%d'))
+
+    paths = {
+        'grades': os.path.join(directory, 'grades', 'Grades.csv'),
+        'mark_hours': os.path.join(directory, 'mark_hours', 'Marks_Hours.csv'),
+        'hours': os.path.join(directory, 'Hours', 'Hours.csv'),
+    }
+    for path in paths.values():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    grades_data.to_csv(paths['grades'], index=False)
+
+    marks_hours = pd.DataFrame(marks * np.asarray(hours), columns=names)
+    marks_hours.insert(0, 'Date/Time', grades_data['Date/Time'])
+    marks_hours['Total'] = marks_hours[names].sum(axis=1)
+    marks_hours.to_csv(paths['mark_hours'], index=False)
+
+    pd.DataFrame([hours], columns=names).to_csv(paths['hours'], index=False)
+    return paths, names, hours
+
+
+# Best wall time of a few runs and the peak traced memory of one run
+def measure(func, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': min(times), 'peak_bytes': peak}
+
+
+def bench_calculator_gpa(sizes):
+    results = {}
+    for subjects in sizes['subjects']:
+        _, hours = preset_subjects(subjects)
+        marks = list(make_rng(subjects).integers(1, 101, size=subjects))
+
+        # Same loop as main.py's form
+        def calculator():
+            total = [m * h for m, h in zip(marks, hours) if m > 0 and h > 0]
+            return sum(total) / sum(hours)
+
+        results[f'calculator_gpa[subjects={subjects}]'] = measure(calculator, repeat=100)
+    return results
+
+
+def bench_estimation(sizes):
+    results = {'final_exam_mark_estimation': measure(lambda: final_exam_mark_estimation(0, 10, 4, 40), repeat=100)}
+    for subjects in sizes['subjects']:
+        names, hours = preset_subjects(subjects)
+        row = pd.Series([0, 0] + [80] * subjects, index=['Date/Time', 'GPA'] + names)
+        results[f'calculate_final_gpa[subjects={subjects}]'] = measure(
+            lambda: calculate_final_gpa(row, hours, 0, 10, names[:2]), repeat=100)
+    return results
+
+
+def bench_saves(sizes):
+    results = {}
+    names, hours = preset_subjects(11)
+    marks = [80] * len(names)
+    for history in sizes['history']:
+        with tempfile.TemporaryDirectory() as directory:
+            paths, _, _ = synthetic_history(directory, history, 11)
+            results[f'save_grades[history={history}]'] = measure(
+                lambda: save_grades(names, marks, 80.0, paths['grades']), repeat=10)
+            results[f'save_marks_hours[history={history}]'] = measure(
+                lambda: save_marks_hours(names, marks, hours, paths['mark_hours']), repeat=10)
+    return results
+
+
+# load -> estimate -> simulate on a synthetic history
+def bench_pipeline(sizes):
+    results = {}
+    for snapshots in sizes['snapshots']:
+        for subjects in sizes['subjects']:
+            with tempfile.TemporaryDirectory() as directory:
+                paths, names, _ = synthetic_history(directory, snapshots, subjects)
+
+                def pipeline():
+                    grades_data = load_table(paths['grades'])
+                    hours_data = load_table(paths['hours'])
+                    estimate_final_gpa_series(grades_data, hours_data, names[:2], 0, 10, make_rng(0))
+                    simulate_final_gpa_series(grades_data, hours_data, names[:2], 0, 10, 90, 10000, rng=make_rng(0))
+
+                results[f'pipeline[snapshots={snapshots},subjects={subjects}]'] = measure(pipeline, repeat=3)
+    return results
+
+
+# Every mistake range up to 10 x every 50-weighted set of 4 candidate subjects
+def bench_sweep(sizes):
+    results = {}
+    for subjects in sizes['subjects']:
+        with tempfile.TemporaryDirectory() as directory:
+            paths, names, _ = synthetic_history(directory, 10, subjects)
+            grades_data = load_table(paths['grades'])
+            hours_data = load_table(paths['hours'])
+            results[f'scenario_sweep[subjects={subjects}]'] = measure(
+                lambda: scenario_table(grades_data, hours_data, 90, 10, names[:4], draws=10000), repeat=3)
+    return results
+
+
+SUITES = {
+    'calculator': bench_calculator_gpa,
+    'estimation': bench_estimation,
+    'saves': bench_saves,
+    'pipeline': bench_pipeline,
+    'sweep': bench_sweep,
+}
+
+
+def compare(results, baseline):
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and result['seconds'] > baseline[name]['seconds'] * REGRESSION_RATIO:
+            regressions.append(f"{name}: {baseline[name]['seconds'] * 1000:.3f} ms -> {result['seconds'] * 1000:.3f} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the GPA and estimation hot paths.")
+    parser.add_argument('suites', nargs='*', help=f"Suites to run: {', '.join(SUITES)} (default: all)")
+    parser.add_argument('--quick', action='store_true', help="Smaller sizes for a fast run")
+    parser.add_argument('--save-baseline', action='store_true', help=f"Store the results in {BASELINE_PATH}")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    args = parser.parse_args(argv)
+    unknown = [suite for suite in args.suites if suite not in SUITES]
+    if unknown:
+        parser.error(f"unknown suites {unknown}")
+
+    sizes = QUICK_SIZES if args.quick else FULL_SIZES
+    results = {}
+    for suite in args.suites or SUITES:
+        for name, result in SUITES[suite](sizes).items():
+            results[name] = result
+            print(f"{name:60} {result['seconds'] * 1000:12.3f} ms {result['peak_bytes'] / 1024:12.1f} KiB")
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f))
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from grade_aggregates import verify_aggregates
+from grade_store import save_grades, save_marks_hours
+
+SUBJECTS = ['Math', 'Physics', 'Chemistry', 'Biology', 'English']
+HOURS = [6, 4, 4, 4, 5]
+
+
+# Each save is tagged with its writer and sequence number in the GPA column;
+# every few saves a writer adds its own subject to force header rewrites
+def writer(directory, process, thread, saves):
+    grades_path = os.path.join(directory, 'grades', 'Grades.csv')
+    marks_hours_path = os.path.join(directory, 'mark_hours', 'Marks_Hours.csv')
+    for i in range(saves):
+        subjects, hours = list(SUBJECTS), list(HOURS)
+        if i % 10 == 9:
+            subjects.append(f'Extra {process}-{thread}')
+            hours.append(1)
+        marks = [(i + s) % 101 for s in range(len(subjects))]
+        save_grades(subjects, marks, process * 1e6 + thread * 1e3 + i, grades_path)
+        save_marks_hours(subjects, marks, hours, marks_hours_path)
+
+
+def run_process(directory, process, threads, saves):
+    workers = [threading.Thread(target=writer, args=(directory, process, t, saves)) for t in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+# Every row must be whole (one cell per header column) and every save present once
+def check(directory, processes, threads, saves):
+    problems = []
+    grades_path = os.path.join(directory, 'grades', 'Grades.csv')
+    marks_hours_path = os.path.join(directory, 'mark_hours', 'Marks_Hours.csv')
+    expected = {p * 1e6 + t * 1e3 + i for p in range(processes) for t in range(threads) for i in range(saves)}
+
+    for file_path in (grades_path, marks_hours_path):
+        with open(file_path, newline='') as f:
+            rows = list(csv.reader(f))
+        header, rows = rows[0], rows[1:]
+        broken = [row for row in rows if len(row) != len(header)]
+        if broken:
+            problems.append(f'{file_path}: {len(broken)} rows with the wrong number of cells')
+        if len(rows) != len(expected):
+            problems.append(f'{file_path}: {len(rows)} rows, expected {len(expected)}')
+        if file_path == grades_path:
+            seen = [float(row[header.index('GPA')]) for row in rows]
+            if set(seen) != expected or len(seen) != len(set(seen)):
+                problems.append(f'{file_path}: lost or duplicated saves')
+
+    problems += [f'{grades_path}: {p}' for p in verify_aggregates(grades_path, 'GPA')]
+    problems += [f'{marks_hours_path}: {p}' for p in verify_aggregates(marks_hours_path, 'Total')]
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hammer the CSV savers from many threads and processes.")
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--saves', type=int, default=100, help="Saves per thread")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.processes) as pool:
+            for future in [pool.submit(run_process, directory, p, args.threads, args.saves)
+                           for p in range(args.processes)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        total = args.processes * args.threads * args.saves
+        print(f"{total} saves from {args.processes} processes x {args.threads} threads in {elapsed:.2f} s "
+              f"({total / elapsed:.0f} saves/s)")
+        problems = check(directory, args.processes, args.threads, args.saves)
+        for problem in problems:
+            print(f"FAILED {problem}")
+        if problems:
+            sys.exit(1)
+        print("OK: no rows lost, duplicated or torn")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import numpy as np
+from data_cache import cached
+from instrumentation import timed
+
+# Points sent to the browser per series, about two per pixel of a full-width chart
+MAX_POINTS = 2000
+
+
+# Indices of the min and max point of each bucket (plus both ends), in order.
+# Keeps the peaks and dips that matter for the goal comparison.
+def downsample_indices(y, max_points=MAX_POINTS):
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= max_points:
+        return np.arange(n)
+
+    buckets = max(1, max_points // 2)
+    size = -(-n // buckets)
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+
+    lows = offsets + np.argmin(np.where(np.isnan(padded), np.inf, padded), axis=1)
+    highs = offsets + np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis=1)
+    indices = np.unique(np.concatenate([[0, n - 1], lows, highs]))
+    return indices[indices < n]
+
+
+def downsample(x, y, max_points=MAX_POINTS):
+    x, y = np.asarray(x), np.asarray(y, dtype=float)
+    indices = downsample_indices(y, max_points)
+    return x[indices], y[indices]
+
+
+def _layout(fig, grade_goal):
+    fig.update_layout(
+        xaxis_title='Date/Time',
+        yaxis_title='GPA',
+        yaxis=dict(range=[max(0, grade_goal - 5), 100]),
+        height=400,
+        showlegend=True
+    )
+    return fig
+
+
+# Goal line as its two end points; traces filled 'tonexty' shade against it
+def _goal_trace(x, grade_goal):
+    import plotly.graph_objects as go
+
+    ends = [x[0], x[-1]] if len(x) else []
+    return go.Scatter(
+        x=ends,
+        y=[grade_goal] * len(ends),
+        mode='lines',
+        name='Grade Goal',
+        line=dict(color='red', dash='dash')
+    )
+
+
+@timed
+def build_goal_chart(x, y, grade_goal, name, color, fill_color, max_points=MAX_POINTS):
+    # plotly is only loaded when a figure is not in the cache
+    import plotly.graph_objects as go
+
+    x, y = downsample(x, y, max_points)
+    fig = go.Figure()
+    fig.add_trace(_goal_trace(x, grade_goal))
+
+    # One filled trace shades the area between the series and the goal
+    fig.add_trace(go.Scatter(
+        x=x,
+        y=y,
+        mode='lines',
+        name=name,
+        line=dict(color=color),
+        fill='tonexty',
+        fillcolor=fill_color
+    ))
+    return _layout(fig, grade_goal)
+
+
+# GPA chart with the moving average of trends.rolling_stats and the
+# forecast line (with its band) up to the final exam date
+@timed
+def build_trend_chart(x, y, grade_goal, rolling, forecast, max_points=MAX_POINTS):
+    import plotly.graph_objects as go
+
+    fig = build_goal_chart(x, y, grade_goal, 'GPA', 'blue', 'rgba(0, 0, 255, 0.2)', max_points)
+    dates, average = downsample(rolling['Date'], rolling['Moving Average'], max_points)
+    fig.add_trace(go.Scatter(
+        x=dates,
+        y=average,
+        mode='lines',
+        name='Moving Average',
+        line=dict(color='orange')
+    ))
+    if forecast is not None:
+        fig.add_trace(go.Scatter(
+            x=np.concatenate([forecast['dates'], forecast['dates'][::-1]]),
+            y=np.concatenate([forecast['high'], forecast['low'][::-1]]),
+            fill='toself',
+            fillcolor='rgba(255, 165, 0, 0.15)',
+            line=dict(color='rgba(255, 255, 255, 0)'),
+            hoverinfo='skip',
+            showlegend=False
+        ))
+        fig.add_trace(go.Scatter(
+            x=forecast['dates'],
+            y=forecast['values'],
+            mode='lines',
+            name='Trend Forecast',
+            line=dict(color='orange', dash='dot')
+        ))
+    return fig
+
+
+@timed
+def build_band_chart(x, mean, low, high, goal_probability, grade_goal, max_points=MAX_POINTS):
+    import plotly.graph_objects as go
+
+    indices = downsample_indices(mean, max_points)
+    x = np.asarray(x)[indices]
+    fig = go.Figure()
+    fig.add_trace(_goal_trace(x, grade_goal))
+
+    # 5th to 95th percentile band
+    fig.add_trace(go.Scatter(
+        x=x,
+        y=np.asarray(low)[indices],
+        mode='lines',
+        line=dict(color='rgba(255, 255, 255, 0)'),
+        showlegend=False,
+        hoverinfo='skip'
+    ))
+
+    fig.add_trace(go.Scatter(
+        x=x,
+        y=np.asarray(high)[indices],
+        mode='lines',
+        fill='tonexty',
+        fillcolor='rgba(0, 255, 0, 0.2)',
+        line=dict(color='rgba(255, 255, 255, 0)'),
+        name='5th-95th Percentile'
+    ))
+
+    fig.add_trace(go.Scatter(
+        x=x,
+        y=np.asarray(mean)[indices],
+        mode='lines',
+        name='Mean Estimated GPA',
+        line=dict(color='green'),
+        customdata=np.asarray(goal_probability)[indices],
+        hovertemplate='%{y:.2f} (goal chance %{customdata:.0%})'
+    ))
+    return _layout(fig, grade_goal)
+
+
+# Heatmap of one metric of a scenario_sweep table: mistake ranges down,
+# 50-weighted sets across, in the order of the table
+@timed
+def build_heatmap(table, metric, grade_goal):
+    import plotly.graph_objects as go
+
+    grid = table.pivot(index='Mistakes', columns='50-Weighted', values=metric)
+    grid = grid.loc[table['Mistakes'].unique(), table['50-Weighted'].unique()]
+    probability = metric == 'Goal Probability'
+    fig = go.Figure(go.Heatmap(
+        z=grid.to_numpy(),
+        x=list(grid.columns),
+        y=list(grid.index),
+        colorscale='RdYlGn',
+        zmin=0 if probability else None,
+        zmax=1 if probability else None,
+        zmid=None if probability else grade_goal,
+        hovertemplate='%{y} mistakes, 50-weighted: %{x}<br>' + metric + ': %{z:.2f}<extra></extra>'
+    ))
+    fig.update_layout(xaxis_title='50-Weighted Subjects', yaxis_title='Mistakes (min-max)', height=500)
+    fig.update_yaxes(autorange='reversed')
+    return fig
+
+
+# Figure specs (plain dicts) are cached on the caller's key for their input data
+def goal_chart(key, x, y, grade_goal, name, color, fill_color, max_points=MAX_POINTS):
+    return cached(('goal_chart', key, grade_goal, name, max_points),
+                  lambda: build_goal_chart(x, y, grade_goal, name, color, fill_color, max_points).to_dict())
+
+
+def trend_chart(key, x, y, grade_goal, rolling, forecast, max_points=MAX_POINTS):
+    return cached(('trend_chart', key, grade_goal, max_points),
+                  lambda: build_trend_chart(x, y, grade_goal, rolling, forecast, max_points).to_dict())
+
+
+def heatmap_chart(key, table, metric, grade_goal):
+    return cached(('heatmap_chart', key, metric, grade_goal),
+                  lambda: build_heatmap(table, metric, grade_goal).to_dict())
+
+
+def band_chart(key, x, mean, low, high, goal_probability, grade_goal, max_points=MAX_POINTS):
+    return cached(('band_chart', key, grade_goal, max_points),
+                  lambda: build_band_chart(x, mean, low, high, goal_probability, grade_goal,
+                                           max_points).to_dict())
@@ -0,0 +1,111 @@
+import argparse
+import os
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from columnar_store import load_table
+from estimation import estimate_final_gpa_series, simulate_final_gpa_series, make_rng
+from goal_solver import goal_table
+
+# Students handed to a worker process at a time
+CHUNK_SIZE = 8
+
+
+# A student's history directory has the same layout as the app's csv/ folder
+def history_paths(history_dir):
+    return (os.path.join(history_dir, 'grades', 'Grades.csv'),
+            os.path.join(history_dir, 'Hours', 'Hours.csv'))
+
+
+# Seed derived from the student name, so results do not depend on scheduling
+def student_seed(seed, student):
+    return np.random.SeedSequence([seed, zlib.crc32(student.encode('utf-8'))])
+
+
+# Load -> estimate final GPA -> compare with the goal, for one history
+def analyze_history(history_dir, subjects_for_50, start, finish, grade_goal, seed=0, draws=0):
+    grades_csv_path, hours_csv_path = history_paths(history_dir)
+    grades_data = load_table(grades_csv_path)
+    hours_data = load_table(hours_csv_path)
+    student = os.path.basename(os.path.normpath(history_dir))
+    rng = make_rng(student_seed(seed, student))
+
+    gpa_df = estimate_final_gpa_series(grades_data, hours_data, subjects_for_50, start, finish, rng)
+    summary = {
+        'Student': student,
+        'Snapshots': len(grades_data),
+        'Latest Date': grades_data['Date/Time'].iloc[-1] if len(grades_data) else None,
+        'Latest GPA': grades_data['GPA'].iloc[-1] if len(grades_data) else np.nan,
+        'GPA Average': grades_data['GPA'].mean(),
+        'Estimated Final GPA': gpa_df['GPA'].iloc[-1] if len(gpa_df) else np.nan,
+    }
+    summary['Goal Gap'] = summary['Estimated Final GPA'] - grade_goal
+    summary['Goal Reached'] = bool(summary['Goal Gap'] >= 0)
+    if len(grades_data):
+        # Share of every final needed to reach the goal (above 1 is out of reach)
+        summary['Required Final Share'] = goal_table(grades_data, hours_data, subjects_for_50, grade_goal)[2]
+
+    if draws and len(grades_data):
+        # Only the latest snapshot matters for the cohort summary
+        sim_df = simulate_final_gpa_series(grades_data.tail(1), hours_data, subjects_for_50, start, finish,
+                                           grade_goal, draws, rng=rng)
+        summary['Mean Final GPA'] = sim_df['Mean'].iloc[0]
+        summary['P5'] = sim_df['P5'].iloc[0]
+        summary['P95'] = sim_df['P95'].iloc[0]
+        summary['Goal Probability'] = sim_df['Goal Probability'].iloc[0]
+    return summary
+
+
+def _analyze(args):
+    history_dir = args[0]
+    try:
+        return analyze_history(*args)
+    except Exception as e:
+        return {'Student': os.path.basename(os.path.normpath(history_dir)), 'Error': f'{type(e).__name__}: {e}'}
+
+
+def find_histories(root):
+    return sorted(os.path.join(root, name) for name in os.listdir(root)
+                  if os.path.exists(history_paths(os.path.join(root, name))[0]))
+
+
+# Analyze every history under root in a process pool and merge the summaries
+def analyze_cohort(root, subjects_for_50, start, finish, grade_goal, seed=0, draws=0,
+                   workers=None, chunk_size=CHUNK_SIZE):
+    jobs = [(history_dir, subjects_for_50, start, finish, grade_goal, seed, draws)
+            for history_dir in find_histories(root)]
+    if workers == 1:
+        rows = [_analyze(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(_analyze, jobs, chunksize=chunk_size))
+
+    summary = pd.DataFrame(rows)
+    if 'Error' in summary.columns:
+        summary = summary[[c for c in summary.columns if c != 'Error'] + ['Error']]
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Analytics estimation over a cohort of student histories.")
+    parser.add_argument('root', help="Directory with one csv/-style history directory per student")
+    parser.add_argument('--subjects-for-50', nargs='*', default=[], help="Subjects with a 50-weighted final")
+    parser.add_argument('--start', type=int, default=0, help="Minimum mistakes in finals")
+    parser.add_argument('--finish', type=int, default=1, help="Maximum mistakes in finals")
+    parser.add_argument('--goal', type=float, default=90.0, help="Grade goal")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--draws', type=int, default=0, help="Monte Carlo draws per student (0 to skip)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('-o', '--output', help="Summary CSV file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    summary = analyze_cohort(args.root, args.subjects_for_50, args.start, args.finish, args.goal, args.seed,
+                             args.draws, args.workers, args.chunk_size)
+    summary.to_csv(args.output or sys.stdout, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import os
+import sys
+import threading
+from grade_store import (GRADES_CSV_PATH, MARKS_HOURS_CSV_PATH, file_lock, history_files, in_database,
+                         in_event_log, load_history)
+from instrumentation import count, enabled as instrumentation_enabled, timed
+
+# pyarrow is optional, without it every table is read from the CSV files
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+HOURS_CSV_PATH = 'csv/Hours/Hours.csv'
+TABLES = [GRADES_CSV_PATH, MARKS_HOURS_CSV_PATH, HOURS_CSV_PATH]
+
+
+def columnar_path(csv_path):
+    return os.path.splitext(csv_path)[0] + '.parquet'
+
+
+# The Parquet copy is stale once any of the CSV files it was built from changes
+def is_fresh(csv_path):
+    parquet_path = columnar_path(csv_path)
+    if not os.path.exists(parquet_path):
+        return False
+    newest_csv = max((os.path.getmtime(path) for path in history_files(csv_path)), default=0)
+    return os.path.getmtime(parquet_path) >= newest_csv
+
+
+# One-shot CSV -> Parquet conversion of a table and its shards
+def migrate_to_columnar(csv_path):
+    if pq is None:
+        raise ImportError("pyarrow is required for the columnar storage format.")
+
+    parquet_path = columnar_path(csv_path)
+    table = pa.Table.from_pandas(load_history(csv_path), preserve_index=False)
+    tmp_path = f'{parquet_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, parquet_path)
+    return parquet_path
+
+
+# Rebuild a stale Parquet copy under the history's lock, so no save lands
+# halfway through; skipped when another session rebuilt it while we waited
+def refresh_columnar(csv_path):
+    with file_lock(csv_path):
+        if not is_fresh(csv_path):
+            migrate_to_columnar(csv_path)
+
+
+# Write a Parquet table back out in the CSV format the app reads.
+# The Parquet table already holds the shards, so they are folded in. The
+# history stays locked throughout, and a copy older than the CSV files is
+# rebuilt first so rows saved since the migration are kept.
+def export_to_csv(csv_path):
+    if pq is None:
+        raise ImportError("pyarrow is required for the columnar storage format.")
+
+    with file_lock(csv_path):
+        if not is_fresh(csv_path) and history_files(csv_path):
+            migrate_to_columnar(csv_path)
+        tmp_path = f'{csv_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        pq.read_table(columnar_path(csv_path)).to_pandas().to_csv(tmp_path, index=False)
+        os.replace(tmp_path, csv_path)
+        for path in history_files(csv_path):
+            if path != csv_path:
+                os.remove(path)
+
+
+# Load a table, reading only the requested columns.
+# Tables that were migrated are read from memory-mapped Parquet, refreshed
+# from the CSV files first if new rows were saved since. Histories kept in
+# the SQLite database or an event log are always read from there, the
+# database only for the given student (all if None).
+@timed
+def load_table(csv_path, columns=None, student=None):
+    if (pq is not None and os.path.exists(columnar_path(csv_path)) and not in_database(csv_path)
+            and not in_event_log(csv_path)):
+        if not is_fresh(csv_path) and history_files(csv_path):
+            refresh_columnar(csv_path)
+        if columns is not None:
+            available = pq.read_schema(columnar_path(csv_path)).names
+            columns = [c for c in columns if c in available]
+        if instrumentation_enabled():
+            count('bytes_read', os.path.getsize(columnar_path(csv_path)))
+        return pq.read_table(columnar_path(csv_path), columns=columns, memory_map=True).to_pandas()
+    return load_history(csv_path, columns, student=student)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'migrate'
+    for csv_path in TABLES:
+        if command == 'migrate' and history_files(csv_path):
+            with file_lock(csv_path):
+                print(f"{csv_path} -> {migrate_to_columnar(csv_path)}")
+        elif command == 'export' and os.path.exists(columnar_path(csv_path)):
+            export_to_csv(csv_path)
+            print(f"{columnar_path(csv_path)} -> {csv_path}")
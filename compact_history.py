@@ -0,0 +1,160 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from estimation import grades_matrix
+
+# Mark of a subject a snapshot has no grade for, in uint8 mark matrices
+MISSING_MARK = np.iinfo(np.uint8).max
+
+
+# Subject names shared by many histories (e.g. a cohort). Each history keeps
+# small integer codes into it instead of its own copies of the strings.
+class SubjectDictionary:
+    def __init__(self):
+        self.names = []
+        self._codes = {}
+
+    def code(self, name):
+        if name not in self._codes:
+            self._codes[name] = len(self.names)
+            self.names.append(name)
+        return self._codes[name]
+
+    def encode(self, subjects):
+        return np.array([self.code(name) for name in subjects], dtype=np.uint16)
+
+    def decode(self, codes):
+        return [self.names[code] for code in codes]
+
+
+# Whole numbers from 0 up to limit as uint8 (NaN stored as missing), or None
+def _small_ints(values, limit, missing=MISSING_MARK):
+    present = values[~np.isnan(values)]
+    if len(present) and (present.min() < 0 or present.max() > limit or (present != np.round(present)).any()):
+        return None
+    return np.where(np.isnan(values), missing, values).astype(np.uint8)
+
+
+# A Grades history held as typed arrays: datetime64 dates, uint8 marks and
+# hours, float32 GPA and dictionary-encoded subjects. Fractional marks fall
+# back to float32. Dates, GPA and row slices are views, not copies; the
+# estimation code reads it through grades_matrix like a Grades table.
+class CompactHistory:
+    def __init__(self, dates, codes, marks, hours, gpa, dictionary):
+        self.dates = dates
+        self.codes = codes
+        self.marks = marks
+        self.hours = hours
+        self.gpa = gpa
+        self.dictionary = dictionary
+
+    @classmethod
+    def from_frames(cls, grades_data, hours_data, dictionary=None):
+        dictionary = SubjectDictionary() if dictionary is None else dictionary
+        subjects, grades, hours = grades_matrix(grades_data, hours_data)
+        marks = _small_ints(grades, 100)
+        compact_hours = _small_ints(hours, MISSING_MARK - 1)
+        return cls(
+            pd.to_datetime(grades_data['Date/Time']).to_numpy().astype('datetime64[s]'),
+            dictionary.encode(subjects),
+            grades.astype(np.float32) if marks is None else marks,
+            hours.astype(np.float32) if compact_hours is None else compact_hours,
+            grades_data['GPA'].to_numpy(dtype=np.float32),
+            dictionary,
+        )
+
+    @property
+    def subjects(self):
+        return self.dictionary.decode(self.codes)
+
+    @property
+    def columns(self):
+        return ['Date/Time', 'GPA'] + self.subjects
+
+    def __len__(self):
+        return len(self.dates)
+
+    def _float(self, marks):
+        if marks.dtype == np.uint8:
+            return np.where(marks == MISSING_MARK, np.nan, marks)
+        return marks.astype(float)
+
+    # Float marks with NaN for missing ones, as the estimation code expects
+    def grades(self):
+        return self._float(self.marks)
+
+    def grades_matrix(self):
+        return self.subjects, self.grades(), self.hours.astype(float)
+
+    def __getitem__(self, column):
+        if column == 'Date/Time':
+            return self.dates
+        if column == 'GPA':
+            return self.gpa
+        return self._float(self.marks[:, self.subjects.index(column)])
+
+    def rows(self, start=None, stop=None):
+        return CompactHistory(self.dates[start:stop], self.codes, self.marks[start:stop], self.hours,
+                              self.gpa[start:stop], self.dictionary)
+
+    def tail(self, n=5):
+        return self.rows(max(len(self) - n, 0))
+
+    # Back to a Grades-style table (a copy)
+    def to_frame(self):
+        frame = pd.DataFrame(self.grades(), columns=self.subjects)
+        frame.insert(0, 'GPA', self.gpa.astype(float))
+        frame.insert(0, 'Date/Time', self.dates)
+        return frame
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.dates, self.codes, self.marks, self.hours, self.gpa))
+
+
+# Bytes held by the loaded Grades frame (with its parsed dates, as the
+# Analytics page keeps them) and by the compact history
+def memory_report(histories):
+    frame_bytes = compact_bytes = snapshots = 0
+    dictionaries = {}
+    for grades_data, history in histories:
+        frame_bytes += int(grades_data.memory_usage(deep=True).sum())
+        frame_bytes += int(pd.to_datetime(grades_data['Date/Time']).memory_usage(deep=True))
+        compact_bytes += history.nbytes
+        snapshots += len(history)
+        dictionaries[id(history.dictionary)] = history.dictionary
+    # The subject names are stored once per dictionary
+    compact_bytes += sum(len(name.encode('utf-8')) for dictionary in dictionaries.values()
+                         for name in dictionary.names)
+    report = pd.DataFrame({
+        'Bytes': [frame_bytes, compact_bytes],
+        'Bytes per Snapshot': [frame_bytes / max(snapshots, 1), compact_bytes / max(snapshots, 1)],
+    }, index=['pandas frames', 'compact'])
+    report['Snapshots'] = snapshots
+    return report
+
+
+def main(argv=None):
+    from columnar_store import load_table
+    from cohort_analytics import find_histories, history_paths
+
+    parser = argparse.ArgumentParser(description="Compare the memory of loaded grade histories with their "
+                                                 "compact form.")
+    parser.add_argument('path', nargs='?', default='csv',
+                        help="A csv/-style history directory, or a cohort directory with one per student")
+    args = parser.parse_args(argv)
+
+    directories = [args.path] if os.path.exists(history_paths(args.path)[0]) else find_histories(args.path)
+    if not directories:
+        parser.error(f"no Grades.csv under {args.path}")
+    dictionary = SubjectDictionary()
+    histories = []
+    for directory in directories:
+        grades_data, hours_data = (load_table(path) for path in history_paths(directory))
+        histories.append((grades_data, CompactHistory.from_frames(grades_data, hours_data, dictionary)))
+    print(memory_report(histories).to_string(float_format=lambda value: f'{value:,.1f}'))
+
+
+if __name__ == "__main__":
+    main()
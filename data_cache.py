@@ -0,0 +1,97 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+# Memory budget for cached tables and derived results, shared by every
+# session of the Streamlit server process
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+_entries = OrderedDict()
+_sizes = {}
+_total = 0
+_lock = threading.Lock()
+
+
+# A file is considered unchanged while its path, mtime and size match
+def file_fingerprint(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return (os.path.abspath(path), None, None)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+# Fingerprint of a history file and all of its shards (and of the student's
+# snapshots when the history is in the SQLite database)
+def history_fingerprint(file_path, student=None):
+    from grade_store import database_version, history_files
+    return ((os.path.abspath(file_path),) + tuple(file_fingerprint(path) for path in history_files(file_path))
+            + database_version(file_path, student))
+
+
+def size_of(value):
+    if hasattr(value, 'memory_usage'):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(size_of(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(size_of(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def _remove(key):
+    global _total
+    del _entries[key]
+    _total -= _sizes.pop(key)
+
+
+def _evict(max_bytes):
+    while _entries and _total > max_bytes:
+        _remove(next(iter(_entries)))
+
+
+# Return the cached value for key or compute and store it.
+# Cached values are shared between reruns and sessions: do not mutate them.
+def cached(key, compute, max_bytes=None):
+    global _total
+    with _lock:
+        if key in _entries:
+            _entries.move_to_end(key)
+            return _entries[key]
+
+    value = compute()
+    with _lock:
+        if key in _entries:
+            _remove(key)
+        _entries[key] = value
+        _sizes[key] = size_of(value)
+        _total += _sizes[key]
+        _evict(CACHE_MAX_BYTES if max_bytes is None else max_bytes)
+    return value
+
+
+# Load a history table, reusing the parsed frame while its files are unchanged
+def cached_load(file_path, loader, columns=None, student=None):
+    key = ('table', getattr(loader, '__name__', repr(loader)), history_fingerprint(file_path, student))
+    if columns is None and student is None:
+        return cached(key, lambda: loader(file_path))
+    return cached(key + (None if columns is None else tuple(columns),),
+                  lambda: loader(file_path, columns, student=student))
+
+
+def _mentions(key, path):
+    if isinstance(key, tuple):
+        return any(_mentions(part, path) for part in key)
+    return key == path
+
+
+# Drop every entry built from the given file, or everything
+def invalidate(file_path=None):
+    with _lock:
+        path = None if file_path is None else os.path.abspath(file_path)
+        for key in [key for key in _entries if path is None or _mentions(key, path)]:
+            _remove(key)
@@ -0,0 +1,242 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from instrumentation import timed
+
+
+# Final exam model shared by the Analytics page and the batch tools.
+# 'f4' subjects keep 60% of the coursework grade and have a final out of 40,
+# 'f5' subjects keep 50% of the coursework grade and have a final out of 50.
+COURSEWORK_WEIGHT = {'f4': 60, 'f5': 50}
+FINAL_MARK = {'f4': 40, 'f5': 50}
+
+# Number of (start, finish, hour class) sampler tables kept in memory
+SAMPLER_CACHE_SIZE = 128
+
+
+def make_rng(seed=None):
+    return np.random.default_rng(seed)
+
+
+# The weights only depend on whether the hour is above half the range
+def is_high_hour(start, finish, hour):
+    return hour > (finish - start) / 2
+
+
+def mistake_weights(start, finish, high_hour):
+    # Ensure valid range
+    if start > finish:
+        raise ValueError("Start should be less than or equal to finish.")
+
+    values = np.arange(start, finish + 1)
+    # For higher hours, give more weight to lower numbers
+    # For lower hours, give more weight to higher numbers
+    if high_hour:
+        weights = 1 / (np.abs(values - start) + 1)
+    else:
+        weights = 1 / (np.abs(finish - values) + 1)
+    return values, weights / weights.sum()
+
+
+# Inverse-CDF sampler of the number of mistakes in a final exam
+class MistakeSampler:
+    def __init__(self, start, finish, high_hour):
+        self.values, self.weights = mistake_weights(start, finish, high_hour)
+        self.cdf = np.cumsum(self.weights)
+        self.cdf[-1] = 1.0
+
+    def sample(self, size=None, rng=None):
+        rng = make_rng() if rng is None else rng
+        return self.values[np.searchsorted(self.cdf, rng.random(size), side='right')]
+
+
+@lru_cache(maxsize=SAMPLER_CACHE_SIZE)
+def _cached_sampler(start, finish, high_hour):
+    return MistakeSampler(start, finish, high_hour)
+
+
+def get_sampler(start, finish, hour):
+    return _cached_sampler(int(start), int(finish), bool(is_high_hour(start, finish, hour)))
+
+
+def final_exam_mark_estimation(start, finish, hour, mark, rng=None):
+    return int(mark - get_sampler(start, finish, hour).sample(rng=rng))
+
+
+def final_grade(grade, final, hour, type):
+    if type == 'f4':
+        result = ((grade / 100) * 60 + final) * hour
+        return result
+    elif type == 'f5':
+        result = ((grade / 100) * 50 + final) * hour
+        return result
+    else:
+        return 'Wrong Type'
+
+
+# Draw the mistakes made in every final, shape (rows, subjects)
+def draw_mistakes(start, finish, hours, rows, rng=None):
+    rng = make_rng() if rng is None else rng
+    high = is_high_hour(start, finish, np.asarray(hours, dtype=float))
+
+    # Subjects on the same side of the hour threshold share one sampler,
+    # so at most two bulk draws are needed
+    mistakes = np.zeros((rows, len(high)), dtype=np.int64)
+    for high_hour in (False, True):
+        columns = np.flatnonzero(high == high_hour)
+        if len(columns):
+            sampler = _cached_sampler(int(start), int(finish), high_hour)
+            mistakes[:, columns] = sampler.sample((rows, len(columns)), rng)
+    return mistakes
+
+
+# Mean number of mistakes per subject, from the sampler weights
+def expected_mistakes(start, finish, hours):
+    high = is_high_hour(start, finish, np.asarray(hours, dtype=float))
+    means = [_cached_sampler(int(start), int(finish), high_hour) for high_hour in (False, True)]
+    means = [sampler.values @ sampler.weights for sampler in means]
+    return np.where(high, means[1], means[0])
+
+
+# Draw one final exam mark per snapshot and subject, shape (rows, subjects)
+def draw_final_exam_marks(start, finish, hours, f5_mask, rows, rng=None):
+    f5_mask = np.asarray(f5_mask, dtype=bool)
+    finals = np.where(f5_mask, FINAL_MARK['f5'], FINAL_MARK['f4']) * np.ones((rows, 1))
+    return finals - draw_mistakes(start, finish, hours, rows, rng)
+
+
+# Hours of the subjects each snapshot actually has a grade for, normalized
+# per row. Subjects added after a snapshot was saved are blank (NaN) there.
+def snapshot_weights(grades, hours):
+    row_hours = ~np.isnan(grades) * np.asarray(hours, dtype=float)
+    total_hours = row_hours.sum(axis=1, keepdims=True)
+    return np.divide(row_hours, total_hours, out=np.zeros_like(row_hours), where=total_hours != 0)
+
+
+# Weighted final GPA for every snapshot given the final exam marks
+def final_gpa_from_finals(grades, finals, hours, f5_mask):
+    grades = np.atleast_2d(np.asarray(grades, dtype=float))
+    coursework = np.where(f5_mask, COURSEWORK_WEIGHT['f5'], COURSEWORK_WEIGHT['f4'])
+    weights = snapshot_weights(grades, hours)
+    return (((np.nan_to_num(grades) / 100) * coursework + finals) * weights).sum(axis=1)
+
+
+# Estimated final GPA for a whole (rows, subjects) grades matrix in one pass
+def estimate_final_gpa(grades, hours, f5_mask, start, finish, rng=None):
+    grades = np.atleast_2d(np.asarray(grades, dtype=float))
+    f5_mask = np.asarray(f5_mask, dtype=bool)
+    finals = draw_final_exam_marks(start, finish, hours, f5_mask, grades.shape[0], rng)
+    return final_gpa_from_finals(grades, finals, hours, f5_mask)
+
+
+# Coursework part of the final GPA for every snapshot, without the finals
+def coursework_gpa(grades, hours, f5_mask):
+    grades = np.atleast_2d(np.asarray(grades, dtype=float))
+    return final_gpa_from_finals(grades, np.zeros_like(grades), hours, f5_mask)
+
+
+# Final exam part of the GPA, one column per set of snapshot weights and
+# one row per simulated draw
+def simulate_final_contribution(start, finish, hours, f5_mask, weights, draws, rng=None):
+    finals = draw_final_exam_marks(start, finish, hours, f5_mask, draws, rng)
+    return finals @ np.atleast_2d(weights).T
+
+
+def _simulate_chunk(args):
+    start, finish, hours, f5_mask, weights, draws, seed = args
+    return simulate_final_contribution(start, finish, hours, f5_mask, weights, draws, make_rng(seed))
+
+
+# Monte Carlo distribution of the final GPA for every snapshot.
+# The final exams do not depend on the snapshot, so one set of draws is
+# shared by all rows and each row's distribution is a shift of it (one
+# sample per distinct set of graded subjects).
+def simulate_final_gpa(grades, hours, f5_mask, start, finish, grade_goal, draws=10000,
+                       percentiles=(5, 50, 95), rng=None, workers=1):
+    rng = make_rng() if rng is None else rng
+    grades = np.atleast_2d(np.asarray(grades, dtype=float))
+    hours = np.asarray(hours, dtype=float)
+    f5_mask = np.asarray(f5_mask, dtype=bool)
+    weights, pattern = np.unique(snapshot_weights(grades, hours), axis=0, return_inverse=True)
+    pattern = pattern.reshape(-1)
+
+    if workers > 1:
+        # Split the draws across processes, each with its own child seed
+        sizes = [len(chunk) for chunk in np.array_split(np.arange(draws), workers)]
+        seeds = rng.integers(0, 2 ** 63, size=workers)
+        jobs = [(start, finish, hours, f5_mask, weights, size, seed) for size, seed in zip(sizes, seeds)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            contribution = np.concatenate(list(pool.map(_simulate_chunk, jobs)))
+    else:
+        contribution = simulate_final_contribution(start, finish, hours, f5_mask, weights, draws, rng)
+
+    base = coursework_gpa(grades, hours, f5_mask)
+    contribution.sort(axis=0)
+    reached = np.empty(len(base))
+    for k in range(len(weights)):
+        rows = pattern == k
+        reached[rows] = draws - np.searchsorted(contribution[:, k], grade_goal - base[rows], side='left')
+
+    quantiles = np.percentile(contribution, percentiles, axis=0)[:, pattern]
+    return {
+        'mean': base + contribution.mean(axis=0)[pattern],
+        'percentiles': {p: base + q for p, q in zip(percentiles, quantiles)},
+        'goal_probability': reached / draws,
+    }
+
+
+# Subject columns of a Grades table and the matching hours vector.
+# Hours are matched by subject name, falling back to column position.
+# A CompactHistory carries its own hours.
+def grades_matrix(grades_data, hours_data):
+    if hasattr(grades_data, 'grades_matrix'):
+        return grades_data.grades_matrix()
+    subjects = list(grades_data.columns[2:])
+    hours_row = hours_data.iloc[0]
+    if set(subjects).issubset(hours_row.index):
+        hours = hours_row[subjects].to_numpy(dtype=float)
+    else:
+        subjects = subjects[:len(hours_row)]
+        hours = hours_row.to_numpy(dtype=float)[:len(subjects)]
+    grades = grades_data[subjects].to_numpy(dtype=float)
+    return subjects, grades, hours
+
+
+@timed
+def estimate_final_gpa_series(grades_data, hours_data, subjects_for_50, start, finish, rng=None):
+    subjects, grades, hours = grades_matrix(grades_data, hours_data)
+    f5_mask = np.isin(subjects, list(subjects_for_50))
+    gpa = estimate_final_gpa(grades, hours, f5_mask, start, finish, rng)
+    return pd.DataFrame({
+        'Date/Time': pd.to_datetime(grades_data['Date/Time']).to_numpy(),
+        'GPA': gpa,
+    })
+
+
+@timed
+def simulate_final_gpa_series(grades_data, hours_data, subjects_for_50, start, finish, grade_goal,
+                              draws=10000, percentiles=(5, 50, 95), rng=None, workers=1):
+    subjects, grades, hours = grades_matrix(grades_data, hours_data)
+    f5_mask = np.isin(subjects, list(subjects_for_50))
+    result = simulate_final_gpa(grades, hours, f5_mask, start, finish, grade_goal, draws,
+                                percentiles, rng, workers)
+
+    summary = pd.DataFrame({
+        'Date/Time': pd.to_datetime(grades_data['Date/Time']).to_numpy(),
+        'Mean': result['mean'],
+    })
+    for p, values in result['percentiles'].items():
+        summary[f'P{p}'] = values
+    summary['Goal Probability'] = result['goal_probability']
+    return summary
+
+
+def calculate_final_gpa(row, hours_row, start, finish, subjects_for_50, hour_df=None, rng=None):
+    # zip() semantics: extra subjects or hours are ignored
+    count = min(len(row.index) - 2, len(hours_row))
+    subjects = list(row.index[2:2 + count])
+    grades = row.iloc[2:2 + count].to_numpy(dtype=float)
+    hours = np.asarray(hours_row, dtype=float)[:count]
+    f5_mask = np.isin(subjects, list(subjects_for_50))
+    return float(estimate_final_gpa(grades, hours, f5_mask, start, finish, rng)[0])
@@ -0,0 +1,407 @@
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import threading
+from grade_aggregates import append_with_aggregates
+from grade_store import (GRADES_CSV_PATH, MARKS_HOURS_CSV_PATH, drop_torn_line, evolve_header, file_lock,
+                         history_files, read_csv_history)
+from instrumentation import count, enabled as instrumentation_enabled, timed
+
+# A history saved with GPA_STORAGE_BACKEND=events is a log of changes next
+# to its CSV file (Grades.events.csv): each snapshot is a 'Date/Time' event
+# (blank while the date stays the same) followed by one (column, new value)
+# event per column that changed since the previous snapshot, a blank value
+# when a column is no longer set. A save that changes one mark writes three
+# short lines instead of a full row.
+HEADER = ['Column', 'Value']
+
+# The state of every column is written to the checkpoint file every this
+# many snapshots, so one snapshot or the end of the log is found without
+# replaying it from the start
+CHECKPOINT_SNAPSHOTS = 500
+
+# Marks_Hours snapshots saved from the form log each subject's mark and, under
+# this prefix, its hours; the mark * hours products and Total are derived on load
+HOURS_PREFIX = 'Hours/'
+
+# Snapshot count and column state at the end of each log, on the log size
+_tails = {}
+_tails_lock = threading.Lock()
+
+
+def log_path(file_path):
+    return os.path.splitext(file_path)[0] + '.events.csv'
+
+
+def checkpoints_path(file_path):
+    return os.path.splitext(file_path)[0] + '.checkpoints.jsonl'
+
+
+def has_log(file_path):
+    return os.path.exists(log_path(file_path))
+
+
+# Value as written to the log, '' for a missing one
+def _cell(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ''
+    return str(value)
+
+
+# Value read back from the log, as read_csv would parse it
+def _value(cell):
+    for parse in (int, float):
+        try:
+            return parse(cell)
+        except ValueError:
+            pass
+    return cell
+
+
+# Events of one snapshot (record of column -> value, with 'Date/Time'),
+# against the state of the previous one. The date is left blank while it
+# stays the same. state is updated in place.
+def snapshot_events(record, state):
+    date = _cell(record.get('Date/Time'))
+    cells = {column: _cell(value) for column, value in record.items() if column != 'Date/Time'}
+    cells.update((column, '') for column in state if column != 'Date/Time' and column not in cells)
+    events = [('Date/Time', '' if date == state.get('Date/Time') else date)]
+    events += [(column, cell) for column, cell in cells.items() if state.get(column, '') != cell]
+    _apply(state, events)
+    return events
+
+
+def _apply(state, events):
+    for column, cell in events:
+        if cell:
+            state[column] = cell
+        elif column != 'Date/Time':
+            state.pop(column, None)
+
+
+# Complete lines of the log from a byte offset; a line still being written
+# by a save is left out
+def _read_lines(path, offset=0):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    return data[:data.rfind(b'\n') + 1]
+
+
+def _events(path, offset):
+    rows = csv.reader(io.StringIO(_read_lines(path, offset).decode('utf-8'), newline=''))
+    if offset == 0:
+        next(rows, None)
+    return rows
+
+
+# Replay events on top of the state after `snapshots` snapshots, up to the
+# start of snapshot `stop` (or the end of the log)
+def _replay(rows, snapshots, state, stop=None):
+    for column, cell in rows:
+        if column == 'Date/Time':
+            if snapshots == stop:
+                break
+            snapshots += 1
+        _apply(state, [(column, cell)])
+    return snapshots, state
+
+
+# Checkpoints ({'snapshots', 'offset', 'state'}) inside the first `size`
+# bytes of the log. A torn line from a crash is skipped.
+def read_checkpoints(file_path, size):
+    checkpoints = []
+    try:
+        with open(checkpoints_path(file_path)) as f:
+            for line in f:
+                try:
+                    checkpoint = json.loads(line)
+                except ValueError:
+                    continue
+                if checkpoint['offset'] <= size:
+                    checkpoints.append(checkpoint)
+    except FileNotFoundError:
+        pass
+    return checkpoints
+
+
+def _start(file_path, size, snapshots=None):
+    start = {'snapshots': 0, 'offset': 0, 'state': {}}
+    for checkpoint in read_checkpoints(file_path, size):
+        if snapshots is None or checkpoint['snapshots'] <= snapshots:
+            start = checkpoint
+    return start
+
+
+# Snapshot count and column state at the end of the log: from the newest
+# checkpoint, replaying the events written after it
+def tail_state(file_path):
+    path = log_path(file_path)
+    if not os.path.exists(path):
+        return 0, {}
+    key = os.path.abspath(path)
+    size = os.path.getsize(path)
+    with _tails_lock:
+        tail = _tails.get(key)
+    if tail is not None and tail[0] == size:
+        return tail[1], dict(tail[2])
+
+    start = _start(file_path, size)
+    snapshots, state = _replay(_events(path, start['offset']), start['snapshots'], dict(start['state']))
+    with _tails_lock:
+        _tails[key] = (size, snapshots, dict(state))
+    return snapshots, state
+
+
+# Records of the CSV files of a history, put at the start of a new log
+def _csv_records(file_path):
+    if not history_files(file_path):
+        return []
+    return read_csv_history(file_path).to_dict('records')
+
+
+def _append_checkpoints(file_path, checkpoints, replace=False):
+    path = checkpoints_path(file_path)
+    if replace and os.path.exists(path):
+        os.remove(path)
+    if not checkpoints:
+        return
+    if os.path.exists(path):
+        drop_torn_line(path)
+    with open(path, 'a') as f:
+        f.writelines(json.dumps(checkpoint) + '\n' for checkpoint in checkpoints)
+
+
+# Append snapshots (records of column -> value, with 'Date/Time') to the log
+# with one fsync. The first save of a history starts the log with the rows
+# of its CSV files; the new log replaces any old one in one step. Callers
+# hold file_lock.
+@timed(name='event_log.append_snapshots')
+def append_snapshots(file_path, records):
+    path = log_path(file_path)
+    new_log = not os.path.exists(path)
+    if new_log:
+        records = _csv_records(file_path) + list(records)
+        snapshots, state, offset = 0, {}, 0
+    else:
+        drop_torn_line(path)
+        snapshots, state = tail_state(file_path)
+        offset = os.path.getsize(path)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if new_log:
+        writer.writerow(HEADER)
+    checkpoints = []
+    for record in records:
+        writer.writerows(snapshot_events(record, state))
+        snapshots += 1
+        if snapshots % CHECKPOINT_SNAPSHOTS == 0:
+            checkpoints.append({'snapshots': snapshots, 'offset': offset + len(buffer.getvalue().encode('utf-8')),
+                                'state': dict(state)})
+    data = buffer.getvalue().encode('utf-8')
+    if instrumentation_enabled():
+        count('bytes_written', len(data))
+
+    write_path = path + '.tmp' if new_log else path
+    with open(write_path, 'wb' if new_log else 'ab') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    if new_log:
+        os.replace(write_path, path)
+    with _tails_lock:
+        _tails[os.path.abspath(path)] = (offset + len(data), snapshots, dict(state))
+    _append_checkpoints(file_path, checkpoints, replace=new_log)
+
+
+# Save path of the events backend: the log and the aggregates sidecar are
+# updated under the history's lock. records (a list or a DataFrame) feed the
+# aggregates; cells, when given, are what the log keeps for each of them.
+def save_records(file_path, records, value_column, cells=None):
+    def append(path, rows):
+        if cells is not None:
+            rows = cells
+        elif hasattr(rows, 'columns'):
+            rows = rows.astype(object).where(rows.notna(), None).to_dict('records')
+        append_snapshots(path, rows)
+
+    with file_lock(file_path):
+        append_with_aggregates(file_path, records, value_column, append)
+
+
+# What a Marks_Hours save from the form logs: the marks and the hours
+def marks_hours_cells(subjects, marks, hours, date):
+    cells = {'Date/Time': date}
+    cells.update(zip(subjects, marks))
+    cells.update((HOURS_PREFIX + subject, hour) for subject, hour in zip(subjects, hours))
+    return cells
+
+
+# Snapshots saved with marks and hours get their mark * hours products and
+# Total back; rows imported from the CSV files kept their stored products.
+# table maps each column to its array of values.
+def derive_products(table):
+    import numpy as np
+    hour_columns = [c for c in table if c.startswith(HOURS_PREFIX)]
+    if not hour_columns:
+        return table
+    hours = {column[len(HOURS_PREFIX):]: table.pop(column) for column in hour_columns}
+    derived = ~np.all([np.isnan(values) for values in hours.values()], axis=0)
+    for subject, values in hours.items():
+        if subject in table:
+            table[subject] = _whole(np.where(np.isnan(values), table[subject], table[subject] * values))
+    subjects = [c for c in table if c not in ('Date/Time', 'Total')]
+    total = np.nansum([table[subject] for subject in subjects], axis=0)
+    if 'Total' in table:
+        total = np.where(derived, total, table['Total'])
+    table['Total'] = _whole(total)
+    return table
+
+
+# int64 when every value is a whole number, as the CSV files store products
+def _whole(values):
+    import numpy as np
+    return values.astype(np.int64) if (values == np.round(values)).all() else values
+
+
+def _row(state):
+    row = {'Date/Time': state.get('Date/Time')}
+    row.update((column, _value(cell)) for column, cell in state.items() if column != 'Date/Time')
+    hours = {column[len(HOURS_PREFIX):]: row.pop(column) for column in list(row) if column.startswith(HOURS_PREFIX)}
+    if hours:
+        for subject, hour in hours.items():
+            if subject in row:
+                row[subject] *= hour
+        row['Total'] = sum(value for column, value in row.items() if column not in ('Date/Time', 'Total'))
+    return row
+
+
+# One snapshot (negative indexes count from the end) as column -> value,
+# replayed from the nearest checkpoint before it
+@timed(name='event_log.snapshot')
+def snapshot(file_path, index):
+    snapshots, _ = tail_state(file_path)
+    if index < 0:
+        index += snapshots
+    if not 0 <= index < snapshots:
+        raise IndexError(f"{file_path} has {snapshots} snapshots")
+    path = log_path(file_path)
+    start = _start(file_path, os.path.getsize(path), index + 1)
+    _, state = _replay(_events(path, start['offset']), start['snapshots'], dict(start['state']), index + 1)
+    return _row(state)
+
+
+# The log as the wide table the CSV files hold, one row per snapshot in save
+# order, optionally only some columns and the snapshots between two
+# 'YYYY-MM-DD' dates (inclusive). Every cell takes the value of the last
+# event of its column up to its snapshot, found for all cells at once.
+@timed(name='event_log.load_history')
+def load_history(file_path, columns=None, start=None, end=None):
+    import numpy as np
+    import pandas as pd
+    data = _read_lines(log_path(file_path))
+    if instrumentation_enabled():
+        count('bytes_read', len(data))
+    events = pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False)
+    codes, names = pd.factorize(events['Column'])
+    names = list(names)
+    cells = events['Value'].to_numpy(dtype=object)
+    written = cells != ''
+    boundary = (codes == names.index('Date/Time')) if 'Date/Time' in names else np.zeros(len(codes), dtype=bool)
+    snapshot_of = np.cumsum(boundary) - 1
+
+    # Index of the last event of each column up to each snapshot, -1 before
+    # the first. A blank date means the date did not change.
+    last = np.full((int(boundary.sum()), len(names)), -1)
+    counted = ~(boundary & ~written)
+    last[snapshot_of[counted], codes[counted]] = np.flatnonzero(counted)
+    last = np.maximum.accumulate(last, axis=0)
+
+    # Columns of numbers (with whole numbers written as such) become int64
+    # when no cell is missing, float64 otherwise, like read_csv gives
+    numbers = pd.to_numeric(events['Value'], errors='coerce').to_numpy(dtype=float)
+    text = np.bincount(codes, weights=written & np.isnan(numbers), minlength=len(names)) > 0
+    fractional = written & events['Value'].str.contains(r'[.eEnN]').to_numpy()
+    integral = np.bincount(codes, weights=fractional, minlength=len(names)) == 0
+
+    table = {}
+    for code, name in enumerate(names):
+        index = last[:, code]
+        if name == 'Date/Time' or text[code]:
+            values = np.where(index >= 0, cells[index], None)
+            table[name] = np.where(values == '', None, values)
+            continue
+        values = np.where(index >= 0, numbers[index], np.nan)
+        table[name] = values.astype(np.int64) if integral[code] and not np.isnan(values).any() else values
+    table = derive_products(table)
+
+    header = evolve_header(['Date/Time'], list(table))
+    if columns is not None:
+        header = [c for c in header if c in columns]
+    history = pd.DataFrame({column: table[column] for column in header}, columns=header)
+    if 'Date/Time' in history.columns and (start is not None or end is not None):
+        dates = history['Date/Time'].astype(str)
+        keep = pd.Series(True, index=history.index)
+        if start is not None:
+            keep &= dates >= str(start)
+        if end is not None:
+            keep &= dates <= str(end)
+        history = history[keep].reset_index(drop=True)
+    return history
+
+
+# Start the logs of histories from their CSV files, e.g. before switching a
+# deployment over (the first save does it otherwise)
+def build_logs(file_paths):
+    for file_path in file_paths:
+        if has_log(file_path) or not history_files(file_path):
+            continue
+        with file_lock(file_path):
+            append_snapshots(file_path, [])
+        print(f"{file_path} -> {log_path(file_path)}")
+
+
+# Bytes of the CSV files and of the log (with its checkpoints) of each history
+def storage_report(file_paths):
+    import pandas as pd
+    rows = []
+    for file_path in file_paths:
+        csv_bytes = sum(os.path.getsize(path) for path in history_files(file_path))
+        log_bytes = events = snapshots = 0
+        if has_log(file_path):
+            log_bytes = os.path.getsize(log_path(file_path))
+            if os.path.exists(checkpoints_path(file_path)):
+                log_bytes += os.path.getsize(checkpoints_path(file_path))
+            snapshots, _ = tail_state(file_path)
+            events = _read_lines(log_path(file_path)).count(b'\n') - 1
+        rows.append({'History': file_path, 'Snapshots': snapshots, 'Events': events, 'CSV Bytes': csv_bytes,
+                     'Log Bytes': log_bytes})
+    return pd.DataFrame(rows).set_index('History')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-column change logs of the grade histories.")
+    parser.add_argument('command', choices=['build', 'stats', 'show'],
+                        help="build the logs from the CSV files, compare their size, or show one snapshot")
+    parser.add_argument('index', nargs='?', type=int, default=-1, help="Snapshot to show (default: the last)")
+    parser.add_argument('--history', action='append',
+                        help="History file (default: Grades.csv and Marks_Hours.csv under csv/)")
+    args = parser.parse_args(argv)
+
+    file_paths = args.history or [GRADES_CSV_PATH, MARKS_HOURS_CSV_PATH]
+    if args.command == 'build':
+        build_logs(file_paths)
+    elif args.command == 'stats':
+        print(storage_report(file_paths).to_string())
+    else:
+        for file_path in file_paths:
+            if has_log(file_path):
+                print(f"{file_path}: {snapshot(file_path, args.index)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+from estimation import FINAL_MARK, coursework_gpa, grades_matrix, snapshot_weights
+from instrumentation import timed
+
+
+# Final GPA = coursework part + sum(weight * final mark), with every final
+# mark between 0 and its full mark, so reaching a target is linear in the
+# final marks and is solved in closed form for all snapshots at once.
+def required_final_marks(grades, hours, f5_mask, target):
+    grades = np.atleast_2d(np.asarray(grades, dtype=float))
+    f5_mask = np.asarray(f5_mask, dtype=bool)
+    weights = snapshot_weights(grades, hours)
+    full_marks = np.where(f5_mask, FINAL_MARK['f5'], FINAL_MARK['f4']) * np.ones_like(weights)
+
+    # GPA points the finals must bring in, and the most they can bring in
+    needed = np.maximum(target - coursework_gpa(grades, hours, f5_mask), 0)
+    capacity = (weights * full_marks).sum(axis=1)
+    feasible = needed <= capacity + 1e-9
+
+    # Same share of the full mark in every final
+    share = np.divide(needed, capacity, out=np.zeros_like(needed), where=capacity > 0)
+    uniform = np.minimum(share, 1)[:, None] * full_marks
+
+    # One final on its own, with every other final at full mark
+    others = capacity[:, None] - weights * full_marks
+    alone = np.divide(needed[:, None] - others, weights, out=np.zeros_like(weights), where=weights > 0)
+    alone = np.clip(alone, 0, full_marks)
+
+    # Fewest total marks: fill the subjects with the most hours first,
+    # each mark there is worth the most GPA (fractional knapsack)
+    order = np.argsort(-weights, axis=1, kind='stable')
+    sorted_weights = np.take_along_axis(weights, order, axis=1)
+    sorted_full = np.take_along_axis(full_marks, order, axis=1)
+    before = np.cumsum(sorted_weights * sorted_full, axis=1) - sorted_weights * sorted_full
+    fill = np.divide(needed[:, None] - before, sorted_weights, out=np.zeros_like(weights),
+                     where=sorted_weights > 0)
+    cheapest = np.empty_like(weights)
+    np.put_along_axis(cheapest, order, np.clip(fill, 0, sorted_full), axis=1)
+
+    return {
+        'needed': needed,
+        'feasible': feasible,
+        'share': share,
+        'full_marks': full_marks,
+        'uniform': uniform,
+        'alone': alone,
+        'cheapest': cheapest,
+    }
+
+
+# Per-subject answer to "what do I need in the finals" for one snapshot
+@timed
+def goal_table(grades_data, hours_data, subjects_for_50, target, row=-1):
+    subjects, grades, hours = grades_matrix(grades_data, hours_data)
+    f5_mask = np.isin(subjects, list(subjects_for_50))
+    result = required_final_marks(grades[row], hours, f5_mask, target)
+
+    table = pd.DataFrame({
+        'Subject': subjects,
+        'Final Out Of': result['full_marks'][0],
+        'Same Share In All': result['uniform'][0],
+        'If Others Are Full': result['alone'][0],
+        'Fewest Total Marks': result['cheapest'][0],
+    })
+    table['Mistakes Allowed'] = table['Final Out Of'] - np.ceil(table['Same Share In All'] - 1e-9)
+    table = table[~np.isnan(grades[row])].reset_index(drop=True)
+    return table, bool(result['feasible'][0]), float(result['share'][0])
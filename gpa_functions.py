@@ -1,105 +1,35 @@
 import streamlit as st
-import pandas as pd
-import datetime as dt
-import os
 import json
-
-def create_directory_if_not_exists(path):
-    if not os.path.exists(path):
-        os.makedirs(path)
-
-def save_grades_to_csv(subjects, grades, final_gpa):
-    # Create directory if not exists
-    create_directory_if_not_exists('csv/grades')
-
-    file_path = 'csv/grades/Grades.csv'
-    date_time_str = dt.datetime.now().strftime('%Y%m%d_%H%M%S')
-    if os.path.exists(file_path):
-        existing_df = pd.read_csv(file_path)
-        existing_columns = existing_df.columns.tolist()
-        new_columns = ['Date/Time', 'GPA'] + subjects
-
-        # Check if columns match
-        if set(existing_columns) == set(new_columns):
-            mode = 'a'
-            header = False
-        else:
-            mode = 'w'
-            header = True
-            file_path = f'csv/grades/Grades_{date_time_str}.csv'
-
-        data = {
-            'Date/Time': [dt.datetime.now().strftime('%Y-%m-%d')],
-            'GPA': [final_gpa]
-        }
-        for subject, grade in zip(subjects, grades):
-            data[subject] = [grade]
-
-        df = pd.DataFrame(data)
-        df.to_csv(file_path, mode=mode, header=header, index=False)
-    else:
-        data = {
-            'Date/Time': [dt.datetime.now().strftime('%Y-%m-%d')],
-            'GPA': [final_gpa]
-        }
-        for subject, grade in zip(subjects, grades):
-            data[subject] = [grade]
-
-        df = pd.DataFrame(data)
-        df.to_csv(file_path, mode='w', header=True, index=False)
-
+import grade_store
+from grade_store import DEFAULT_STUDENT, create_directory_if_not_exists, save_grades, save_marks_hours
+from preset_registry import get_registry
+from instrumentation import timed
+
+# Student whose history this session saves and reads. With the SQLite
+# backend several students share the database and pick their name in the
+# sidebar; the CSV files and change logs hold one student's history. The
+# name is kept outside the widget's state, which is dropped on page changes.
+def session_student():
+    if 'student' not in st.session_state:
+        st.session_state.student = DEFAULT_STUDENT
+    if grade_store.STORAGE_BACKEND == 'sqlite':
+        if 'student_input' not in st.session_state:
+            st.session_state.student_input = st.session_state.student
+        st.sidebar.text_input("Student", key='student_input')
+        st.session_state.student = st.session_state.student_input.strip()
+    return st.session_state.student
+
+@timed
+def save_grades_to_csv(subjects, grades, final_gpa, student=None):
+    save_grades(subjects, grades, final_gpa, student=student)
     st.success('Grades saved successfully!')
 
-def save_marks_hours_to_csv(subjects, marks, hours):
-    # Create directory if not exists
-    create_directory_if_not_exists('csv/mark_hours')
-
-    file_path = 'csv/mark_hours/Marks_Hours.csv'
-    date_time_str = dt.datetime.now().strftime('%Y%m%d_%H%M%S')
-    if os.path.exists(file_path):
-        existing_df = pd.read_csv(file_path)
-        existing_columns = existing_df.columns.tolist()
-        new_columns = ['Date/Time'] + subjects + ['Total']
-
-        # Check if columns match
-        if set(existing_columns) == set(new_columns):
-            mode = 'a'
-            header = False
-        else:
-            mode = 'w'
-            header = True
-            file_path = f'csv/mark_hours/Marks_Hours_{date_time_str}.csv'
-
-        data = {
-            'Date/Time': [dt.datetime.now().strftime('%Y-%m-%d')]
-        }
-        total = []
-        for subject, mark, hour in zip(subjects, marks, hours):
-            mark_hour_value = mark * hour
-            data[subject] = [mark_hour_value]
-            total.append(mark_hour_value)
-
-        data['Total'] = [sum(total)]
-
-        df = pd.DataFrame(data)
-        df.to_csv(file_path, mode=mode, header=header, index=False)
-    else:
-        data = {
-            'Date/Time': [dt.datetime.now().strftime('%Y-%m-%d')]
-        }
-        total = []
-        for subject, mark, hour in zip(subjects, marks, hours):
-            mark_hour_value = mark * hour
-            data[subject] = [mark_hour_value]
-            total.append(mark_hour_value)
-
-        data['Total'] = [sum(total)]
-
-        df = pd.DataFrame(data)
-        df.to_csv(file_path, mode='w', header=True, index=False)
-
+@timed
+def save_marks_hours_to_csv(subjects, marks, hours, student=None):
+    save_marks_hours(subjects, marks, hours, student=student)
     st.success('Marks and Hours saved successfully!')
 
+@timed
 def save_preset_to_file(preset_name, subjects, hours, num_subjects):
     preset_data = {
         'num_subjects': num_subjects,
@@ -108,11 +38,21 @@ def save_preset_to_file(preset_name, subjects, hours, num_subjects):
     }
     return json.dumps(preset_data)
 
+@timed
 def load_preset_from_file(uploaded_file):
     preset_data = json.load(uploaded_file)
     return preset_data
 
+@timed
 def apply_preset(preset_name):
+    # Only reset the session lists when another preset is picked
+    if st.session_state.get('applied_preset') == preset_name:
+        return
+    st.session_state.applied_preset = preset_name
+    st.session_state.pop('grade_grid', None)
+    # Class-Templates presets are only read once they are picked
+    if preset_name not in st.session_state.presets and preset_name in get_registry().by_name:
+        st.session_state.presets[preset_name] = get_registry().get(preset_name)
     if preset_name in st.session_state.presets:
         preset_data = st.session_state.presets[preset_name]
         st.session_state.num_subjects = preset_data.get('num_subjects', 0)
@@ -0,0 +1,415 @@
+import datetime as dt
+import json
+import math
+import os
+import sys
+import threading
+from data_cache import history_fingerprint
+from instrumentation import timed
+
+
+def aggregates_path(file_path):
+    return os.path.splitext(file_path)[0] + '.agg.json'
+
+
+# JSON-friendly copy of a file fingerprint, so it compares equal after a round trip
+def _fingerprint(file_path):
+    return json.loads(json.dumps(history_fingerprint(file_path)))
+
+
+def _number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+def empty_aggregates(value_column):
+    return {
+        'value_column': value_column,
+        'count': 0,
+        'sum': 0.0,
+        'min': None,
+        'max': None,
+        'last': None,
+        'subjects': {},
+        'fingerprint': None
+    }
+
+
+# 'YYYY-MM-DD' day of a Date/Time cell, or None if it is not a date
+def snapshot_day(value):
+    try:
+        return dt.date.fromisoformat(str(value)[:10]).isoformat()
+    except ValueError:
+        return None
+
+
+def empty_day():
+    return {'count': 0, 'sum': 0.0, 'sumsq': 0.0, 'subjects': {}}
+
+
+def merge_day(totals, other):
+    totals['count'] += other['count']
+    totals['sum'] += other['sum']
+    totals['sumsq'] += other['sumsq']
+    for subject, (count, total) in other['subjects'].items():
+        mine = totals['subjects'].setdefault(subject, [0, 0.0])
+        mine[0] += count
+        mine[1] += total
+    return totals
+
+
+# Per-day totals of some rows (value count, sum and sum of squares, and the
+# count and sum of every subject), which trends.py turns into time-window
+# statistics without reading the rows again
+def record_days(records, value_column):
+    days = {}
+    for record in records:
+        day = snapshot_day(record.get('Date/Time'))
+        if day is None:
+            continue
+        totals = days.setdefault(day, empty_day())
+        value = _number(record.get(value_column))
+        if value is not None:
+            totals['count'] += 1
+            totals['sum'] += value
+            totals['sumsq'] += value * value
+        for column, cell in record.items():
+            cell = _number(cell) if column not in ('Date/Time', value_column) else None
+            if cell is not None:
+                subject = totals['subjects'].setdefault(column, [0, 0.0])
+                subject[0] += 1
+                subject[1] += cell
+    return days
+
+
+def frame_days(frame, value_column):
+    import pandas as pd
+
+    if 'Date/Time' not in frame.columns or not len(frame):
+        return {}
+    days = frame['Date/Time'].astype(str).str[:10]
+    valid = pd.to_datetime(days, errors='coerce', format='%Y-%m-%d').notna()
+    columns = [column for column in frame.columns if column != 'Date/Time']
+    values = frame.loc[valid, columns].apply(pd.to_numeric, errors='coerce')
+    values.insert(0, 'Day', days[valid])
+    groups = values.groupby('Day', sort=True)
+    counts, sums = groups.count(), groups.sum()
+    squares = (values[value_column] ** 2).groupby(values['Day']).sum() if value_column in columns else None
+
+    result = {}
+    for day, count_row in counts.iterrows():
+        totals = result.setdefault(day, empty_day())
+        for column, count in count_row.items():
+            if not count:
+                continue
+            if column == value_column:
+                totals.update(count=int(count), sum=float(sums.at[day, column]), sumsq=float(squares[day]))
+            else:
+                totals['subjects'][column] = [int(count), float(sums.at[day, column])]
+    return result
+
+
+# The per-day totals live in a JSON-lines file next to the sidecar, one line
+# per day in date order. Saves are almost always for the last day, so a save
+# rewrites the last line or appends one instead of rewriting the whole file.
+def days_path(file_path):
+    return os.path.splitext(file_path)[0] + '.days.jsonl'
+
+
+def _day_line(day, totals):
+    return (json.dumps(dict(totals, day=day)) + '\n').encode('utf-8')
+
+
+def write_days(file_path, days):
+    tmp_path = f'{days_path(file_path)}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        for day in sorted(days):
+            f.write(_day_line(day, days[day]))
+    os.replace(tmp_path, days_path(file_path))
+
+
+# Per-day totals by day, or None if the file is missing or torn
+def read_days(file_path):
+    days = {}
+    try:
+        with open(days_path(file_path), 'rb') as f:
+            for line in f:
+                totals = json.loads(line)
+                days[totals.pop('day')] = totals
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
+    return days
+
+
+# Offset and content of the last line of an open file
+def _last_line(f):
+    end = f.seek(0, os.SEEK_END)
+    block = 4096
+    while True:
+        start = max(end - block, 0)
+        f.seek(start)
+        data = f.read(end - start)
+        cut = data.rfind(b'\n', 0, max(len(data) - 1, 0))
+        if cut >= 0 or start == 0:
+            return start + cut + 1, data[cut + 1:]
+        block *= 2
+
+
+# Fold the totals of newly saved rows into the day file
+def update_days(file_path, delta):
+    if not delta:
+        return
+    added = sorted(delta)
+    with open(days_path(file_path), 'r+b') as f:
+        offset, line = _last_line(f)
+        try:
+            last = json.loads(line) if line.strip() else None
+        except json.JSONDecodeError:
+            last = None
+        if last is None and line.strip():
+            # Torn by a crash: drop the file, the next read rebuilds it
+            f.close()
+            os.remove(days_path(file_path))
+            return
+        if last is None or added[0] >= last['day']:
+            if last is not None and added[0] == last['day']:
+                day = last.pop('day')
+                f.seek(offset)
+                f.truncate()
+                f.write(_day_line(day, merge_day(last, delta[day])))
+                added = added[1:]
+            else:
+                f.seek(0, os.SEEK_END)
+            for day in added:
+                f.write(_day_line(day, delta[day]))
+            return
+    # Rows dated before the last day (e.g. an import of older grades)
+    days = read_days(file_path)
+    for day, totals in delta.items():
+        merge_day(days.setdefault(day, empty_day()), totals)
+    write_days(file_path, days)
+
+
+# Fold one saved row into the running aggregates
+def add_record(aggregates, record):
+    value = _number(record.get(aggregates['value_column']))
+    if value is not None:
+        aggregates['count'] += 1
+        aggregates['sum'] += value
+        aggregates['min'] = value if aggregates['min'] is None else min(aggregates['min'], value)
+        aggregates['max'] = value if aggregates['max'] is None else max(aggregates['max'], value)
+
+    for column, cell in record.items():
+        if column in ('Date/Time', aggregates['value_column']):
+            continue
+        totals = aggregates['subjects'].setdefault(column, {'count': 0, 'sum': 0.0})
+        cell = _number(cell)
+        if cell is not None:
+            totals['count'] += 1
+            totals['sum'] += cell
+
+    aggregates['last'] = {column: (cell if isinstance(cell, str) else _number(cell))
+                          for column, cell in record.items()}
+    return aggregates
+
+
+# Fold a frame of saved rows into the running aggregates
+def add_frame(aggregates, frame):
+    import pandas as pd
+
+    value_column = aggregates['value_column']
+    if value_column in frame.columns:
+        values = pd.to_numeric(frame[value_column], errors='coerce').dropna()
+        if len(values):
+            aggregates['count'] += int(len(values))
+            aggregates['sum'] += float(values.sum())
+            low, high = float(values.min()), float(values.max())
+            aggregates['min'] = low if aggregates['min'] is None else min(aggregates['min'], low)
+            aggregates['max'] = high if aggregates['max'] is None else max(aggregates['max'], high)
+
+    for column in frame.columns:
+        if column in ('Date/Time', value_column):
+            continue
+        totals = aggregates['subjects'].setdefault(column, {'count': 0, 'sum': 0.0})
+        cells = pd.to_numeric(frame[column], errors='coerce').dropna()
+        totals['count'] += int(len(cells))
+        totals['sum'] += float(cells.sum())
+
+    if len(frame):
+        aggregates['last'] = {column: (cell if isinstance(cell, str) else _number(cell))
+                              for column, cell in frame.iloc[-1].items()}
+    return aggregates
+
+
+# Recompute the aggregates (and the per-day totals) from the raw history files
+def build_aggregates(file_path, value_column):
+    from grade_store import load_history
+
+    aggregates = empty_aggregates(value_column)
+    aggregates['days'] = {}
+    try:
+        history = load_history(file_path)
+    except FileNotFoundError:
+        return aggregates
+
+    values = history[value_column].dropna() if value_column in history.columns else []
+    if len(values):
+        aggregates.update(count=int(len(values)), sum=float(values.sum()),
+                          min=float(values.min()), max=float(values.max()))
+
+    for column in history.columns:
+        if column in ('Date/Time', value_column):
+            continue
+        cells = history[column].dropna()
+        aggregates['subjects'][column] = {'count': int(len(cells)), 'sum': float(cells.sum())}
+    aggregates['days'] = frame_days(history, value_column)
+
+    if len(history):
+        aggregates['last'] = {column: (cell if isinstance(cell, str) else _number(cell))
+                              for column, cell in history.iloc[-1].items()}
+    aggregates['fingerprint'] = _fingerprint(file_path)
+    return aggregates
+
+
+def read_aggregates(file_path):
+    try:
+        with open(aggregates_path(file_path)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+# Temporary name per process and thread, so concurrent rebuilds never share one.
+# Rebuilt per-day totals are written first: the sidecar's fingerprint is what
+# marks both files as up to date.
+def write_aggregates(file_path, aggregates):
+    if 'days' in aggregates:
+        write_days(file_path, aggregates['days'])
+    tmp_path = f'{aggregates_path(file_path)}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({key: value for key, value in aggregates.items() if key != 'days'}, f)
+    os.replace(tmp_path, aggregates_path(file_path))
+
+
+# Histories saved before the day file existed are rebuilt once
+def in_sync(aggregates, file_path):
+    return (aggregates is not None and aggregates['fingerprint'] == _fingerprint(file_path)
+            and os.path.exists(days_path(file_path)))
+
+
+# Aggregates of a history file, rebuilt only if the files changed behind our
+# back. In the SQLite database they cover one student (all if None).
+@timed
+def current_aggregates(file_path, value_column, student=None):
+    from grade_store import in_database
+    if in_database(file_path):
+        from sqlite_store import aggregates
+        return aggregates(file_path, value_column, student)
+
+    aggregates = read_aggregates(file_path)
+    if not in_sync(aggregates, file_path):
+        aggregates = rebuild_aggregates(file_path, value_column)
+    return aggregates
+
+
+# Rebuild the sidecar and the day file under the history's lock, so a save
+# cannot slip in between the rebuild and the writes. Unless forced, nothing
+# is rebuilt when a save brought them up to date while we waited.
+def rebuild_aggregates(file_path, value_column, force=False):
+    from grade_store import file_lock
+    with file_lock(file_path):
+        aggregates = read_aggregates(file_path)
+        if force or not in_sync(aggregates, file_path):
+            aggregates = build_aggregates(file_path, value_column)
+            write_aggregates(file_path, aggregates)
+    return aggregates
+
+
+# Append rows (a list of records or a DataFrame) through append(), keeping
+# the sidecar up to date in O(rows)
+def append_with_aggregates(file_path, records, value_column, append):
+    aggregates = read_aggregates(file_path)
+    was_in_sync = in_sync(aggregates, file_path)
+
+    append(file_path, records)
+
+    if was_in_sync:
+        if hasattr(records, 'columns'):
+            aggregates = add_frame(aggregates, records)
+            update_days(file_path, frame_days(records, value_column))
+        else:
+            for record in records:
+                aggregates = add_record(aggregates, record)
+            update_days(file_path, record_days(records, value_column))
+        aggregates['fingerprint'] = _fingerprint(file_path)
+    else:
+        aggregates = build_aggregates(file_path, value_column)
+    write_aggregates(file_path, aggregates)
+
+
+# Per-day totals of a history, for trends.py
+@timed
+def current_days(file_path, value_column, student=None):
+    from grade_store import in_database
+    if in_database(file_path):
+        from sqlite_store import day_totals
+        return day_totals(file_path, value_column, student)
+
+    current_aggregates(file_path, value_column)
+    days = read_days(file_path)
+    if days is None:
+        days = rebuild_aggregates(file_path, value_column, force=True)['days']
+    return days
+
+
+def average(aggregates):
+    return aggregates['sum'] / aggregates['count'] if aggregates['count'] > 0 else 0
+
+
+# Compare the sidecar with a fresh rebuild, ignoring float rounding
+def verify_aggregates(file_path, value_column):
+    stored = read_aggregates(file_path)
+    rebuilt = build_aggregates(file_path, value_column)
+    if stored is None:
+        return ['missing sidecar']
+
+    problems = []
+    if stored['fingerprint'] != rebuilt['fingerprint']:
+        problems.append('history files changed since the last update')
+    for key in ('count', 'sum', 'min', 'max'):
+        a, b = stored[key], rebuilt[key]
+        if (a is None) != (b is None) or (a is not None and not math.isclose(a, b, abs_tol=1e-6)):
+            problems.append(f'{key}: stored {a}, rebuilt {b}')
+    for subject, totals in rebuilt['subjects'].items():
+        saved = stored['subjects'].get(subject, {'count': 0, 'sum': 0.0})
+        if saved['count'] != totals['count'] or not math.isclose(saved['sum'], totals['sum'], abs_tol=1e-6):
+            problems.append(f'{subject}: stored {saved}, rebuilt {totals}')
+    stored_days = read_days(file_path) or {}
+    for day, totals in rebuilt['days'].items():
+        saved = stored_days.get(day, empty_day())
+        pairs = [(saved['count'], saved['sum'], totals['count'], totals['sum'])]
+        pairs += [tuple(saved['subjects'].get(name, [0, 0.0])) + tuple(subject)
+                  for name, subject in totals['subjects'].items()]
+        if any(a_count != b_count or not math.isclose(a_sum, b_sum, abs_tol=1e-6)
+               for a_count, a_sum, b_count, b_sum in pairs):
+            problems.append(f'day {day}: stored {saved}, rebuilt {totals}')
+    return problems
+
+
+if __name__ == "__main__":
+    from grade_store import GRADES_CSV_PATH, MARKS_HOURS_CSV_PATH
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'verify'
+    failed = False
+    for file_path, value_column in [(GRADES_CSV_PATH, 'GPA'), (MARKS_HOURS_CSV_PATH, 'Total')]:
+        if command == 'rebuild':
+            rebuild_aggregates(file_path, value_column, force=True)
+            print(f"Rebuilt {aggregates_path(file_path)}")
+        else:
+            problems = verify_aggregates(file_path, value_column)
+            failed = failed or bool(problems)
+            print(f"{file_path}: {'OK' if not problems else '; '.join(problems)}")
+    sys.exit(1 if failed else 0)
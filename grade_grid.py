@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+
+# Compact names/marks/hours arrays behind the calculator's grid editor.
+# The weighted total and the hours total are kept up to date cell by cell,
+# so an edit costs the same whatever the number of subjects.
+class GradeGrid:
+    def __init__(self, subjects, marks, hours):
+        self.base_subjects = list(subjects)
+        self.base_marks = np.asarray(marks, dtype=np.int64)
+        self.base_hours = np.asarray(hours, dtype=np.int64)
+
+        self.subjects = list(self.base_subjects)
+        self.marks = self.base_marks.copy()
+        self.hours = self.base_hours.copy()
+        self.weighted_total = int(self.marks @ self.hours)
+        self.total_hours = int(self.hours.sum())
+        self.zero_marks = int((self.marks == 0).sum())
+
+        # Edits already folded into the arrays, as reported by st.data_editor
+        self.applied = {}
+
+        # st.data_editor reports edits relative to this frame, so it never changes
+        self.base_frame = pd.DataFrame({
+            'Subject': pd.Series(self.base_subjects, dtype=object),
+            'Marks': self.base_marks,
+            'Hours': self.base_hours
+        })
+
+    def _base_value(self, row, column):
+        if column == 'Subject':
+            return self.base_subjects[row]
+        if column == 'Marks':
+            return int(self.base_marks[row])
+        return int(self.base_hours[row])
+
+    def set_cell(self, row, column, value):
+        if column == 'Subject':
+            self.subjects[row] = value or ''
+        elif column == 'Marks':
+            mark = int(value or 0)
+            self.weighted_total += (mark - int(self.marks[row])) * int(self.hours[row])
+            self.zero_marks += int(mark == 0) - int(self.marks[row] == 0)
+            self.marks[row] = mark
+        elif column == 'Hours':
+            hour = max(1, int(value or 1))
+            self.weighted_total += int(self.marks[row]) * (hour - int(self.hours[row]))
+            self.total_hours += hour - int(self.hours[row])
+            self.hours[row] = hour
+
+    # Fold in the cells whose edit changed since the last rerun. Cells that
+    # are no longer edited go back to their base value.
+    def apply_edits(self, edited_rows):
+        edited_rows = {int(row): dict(changes) for row, changes in edited_rows.items()}
+        for row, changes in edited_rows.items():
+            previous = self.applied.get(row, {})
+            for column, value in changes.items():
+                if column not in previous or previous[column] != value:
+                    self.set_cell(row, column, value)
+        for row, previous in self.applied.items():
+            for column in previous:
+                if column not in edited_rows.get(row, {}):
+                    self.set_cell(row, column, self._base_value(row, column))
+        self.applied = edited_rows
+
+    @property
+    def gpa(self):
+        return self.weighted_total / self.total_hours if self.total_hours > 0 else 0
+
+    def as_lists(self):
+        return list(self.subjects), self.marks.tolist(), self.hours.tolist()
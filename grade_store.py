@@ -0,0 +1,438 @@
+import contextlib
+import csv
+import datetime as dt
+import glob
+import os
+import threading
+from data_cache import file_fingerprint, invalidate
+from grade_aggregates import append_with_aggregates
+from instrumentation import count, enabled as instrumentation_enabled, timed
+
+# fcntl on Linux/macOS, msvcrt on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+GRADES_CSV_PATH = 'csv/grades/Grades.csv'
+MARKS_HOURS_CSV_PATH = 'csv/mark_hours/Marks_Hours.csv'
+
+# 'csv' (default), 'sqlite' to save histories in the database of sqlite_store.py,
+# or 'events' to save only the changed cells to the logs of event_log.py
+STORAGE_BACKEND = os.environ.get('GPA_STORAGE_BACKEND', 'csv')
+
+# Student a snapshot saved to the SQLite database belongs to when the caller
+# does not say. The CSV files and change logs hold one student per directory.
+DEFAULT_STUDENT = os.environ.get('GPA_STUDENT', '')
+
+# Columns that always stay at the end of a table when subjects are added
+TRAILING_COLUMNS = ['Total']
+
+# Called with the history path after every save (see precompute.py)
+_save_listeners = []
+
+
+def create_directory_if_not_exists(path):
+    if path and not os.path.exists(path):
+        os.makedirs(path)
+
+
+# Read only the first line of a history file
+def read_header(file_path):
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, newline='') as f:
+        return next(csv.reader(f), None)
+
+
+# Header with the new subjects added before the trailing columns
+def evolve_header(header, columns):
+    trailing = [c for c in TRAILING_COLUMNS if c in header or c in columns]
+    body = [c for c in header if c not in trailing]
+    body += [c for c in columns if c not in body and c not in trailing]
+    return body + trailing
+
+
+# Exclusive lock on a history file (through a '.lock' file next to it),
+# held across processes while the file and its sidecar are written
+@contextlib.contextmanager
+def file_lock(file_path):
+    create_directory_if_not_exists(os.path.dirname(file_path))
+    with open(file_path + '.lock', 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Rewrite a history file under a wider header; old rows get blank cells.
+# The new file is synced before it replaces the old one, so a crash leaves
+# one or the other.
+def rewrite_with_header(file_path, header):
+    tmp_path = file_path + '.tmp'
+    with open(file_path, newline='') as src, open(tmp_path, 'w', newline='') as dst:
+        reader = csv.DictReader(src)
+        writer = csv.DictWriter(dst, fieldnames=header, restval='')
+        writer.writeheader()
+        for row in reader:
+            writer.writerow(row)
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(tmp_path, file_path)
+
+
+# Offset where the last line of an open file starts, scanning back from end
+def _last_line_start(f, end):
+    position = end
+    while position > 0:
+        step = min(4096, position)
+        f.seek(position - step)
+        newline = f.read(step).rfind(b'\n')
+        if newline >= 0:
+            return position - step + newline + 1
+        position -= step
+    return 0
+
+
+# Drop a half-written last line left by a crash during an append, for files
+# only this app writes, where every line ends with a newline
+def drop_torn_line(file_path):
+    with open(file_path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            return
+        f.seek(end - 1)
+        if f.read(1) != b'\n':
+            f.truncate(_last_line_start(f, end))
+
+
+# Finish the last row of a history file that does not end with a newline.
+# A row cut short by a crash during an append has fewer cells than the
+# header and is dropped; a whole row (or a lone header), as saved by Excel
+# and other editors, gets the missing line ending instead.
+def repair_tail(file_path):
+    header = read_header(file_path)
+    with open(file_path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            return
+        f.seek(end - 1)
+        if f.read(1) == b'\n':
+            return
+        start = _last_line_start(f, end)
+        f.seek(start)
+        cells = next(csv.reader([f.read().decode('utf-8', errors='replace')]), [])
+        if start > 0 and len(cells) != len(header or []):
+            f.truncate(start)
+            return
+        line_ending = b'\r\n'
+        if start > 1:
+            f.seek(start - 2)
+            if f.read(1) != b'\r':
+                line_ending = b'\n'
+        f.seek(end)
+        f.write(line_ending)
+
+
+# Header of a history file, widened for the given columns. Only the header
+# is read; the file is only rewritten when a new subject appears, instead of
+# forking a new timestamped file. Callers hold file_lock.
+def prepare_header(file_path, columns):
+    create_directory_if_not_exists(os.path.dirname(file_path))
+    if os.path.exists(file_path):
+        repair_tail(file_path)
+    header = read_header(file_path)
+    if header is None:
+        header = evolve_header([], columns)
+        with open(file_path, 'w', newline='') as f:
+            csv.writer(f).writerow(header)
+    elif not set(columns).issubset(header):
+        header = evolve_header(header, columns)
+        rewrite_with_header(file_path, header)
+    return header
+
+
+# Append records (column -> value) to a history file with one fsync
+def append_records(file_path, records):
+    columns = []
+    for record in records:
+        columns += [c for c in record if c not in columns]
+    header = prepare_header(file_path, columns)
+
+    with open(file_path, 'a', newline='') as f:
+        csv.DictWriter(f, fieldnames=header, restval='').writerows(records)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# Append a whole frame of rows (bulk imports), blank cells for missing values
+def append_frame(file_path, frame):
+    header = prepare_header(file_path, list(frame.columns))
+
+    with open(file_path, 'a', newline='') as f:
+        frame.reindex(columns=header).to_csv(f, header=False, index=False)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def append_record(file_path, record):
+    with file_lock(file_path):
+        append_records(file_path, [record])
+
+
+# Saves of the same file that arrive while a write is in progress are
+# queued and written together by the next writer: one lock, one append and
+# one fsync for the whole burst. Each caller returns once its row is on disk.
+class GroupCommit:
+    def __init__(self, file_path, value_column):
+        self.file_path = file_path
+        self.value_column = value_column
+        self.cond = threading.Condition()
+        self.pending = []
+        self.writing = False
+        self.next_batch = 0
+        self.done_batch = -1
+        self.errors = {}
+
+    def _write(self, records):
+        with file_lock(self.file_path):
+            append_with_aggregates(self.file_path, records, self.value_column, append_records)
+
+    def commit(self, record):
+        with self.cond:
+            self.pending.append(record)
+            batch = self.next_batch
+            while self.done_batch < batch and self.writing:
+                self.cond.wait()
+            if self.done_batch >= batch:
+                error = self.errors.get(batch)
+                if error is not None:
+                    raise error
+                return
+            # Nobody is writing and our row is still queued: write the batch
+            records, self.pending = self.pending, []
+            self.next_batch += 1
+            self.writing = True
+
+        error = None
+        try:
+            self._write(records)
+        except BaseException as e:
+            error = e
+        with self.cond:
+            if error is not None:
+                self.errors[batch] = error
+            self.done_batch = batch
+            self.writing = False
+            self.cond.notify_all()
+        if error is not None:
+            raise error
+
+
+_commits = {}
+_commits_lock = threading.Lock()
+
+
+def group_commit(file_path, record, value_column):
+    key = os.path.abspath(file_path)
+    with _commits_lock:
+        if key not in _commits:
+            _commits[key] = GroupCommit(file_path, value_column)
+    _commits[key].commit(record)
+
+
+def grades_record(subjects, grades, final_gpa, date=None):
+    record = {
+        'Date/Time': (date or dt.datetime.now()).strftime('%Y-%m-%d'),
+        'GPA': final_gpa
+    }
+    for subject, grade in zip(subjects, grades):
+        record[subject] = grade
+    return record
+
+
+def marks_hours_record(subjects, marks, hours, date=None):
+    record = {
+        'Date/Time': (date or dt.datetime.now()).strftime('%Y-%m-%d')
+    }
+    total = []
+    for subject, mark, hour in zip(subjects, marks, hours):
+        mark_hour_value = mark * hour
+        record[subject] = mark_hour_value
+        total.append(mark_hour_value)
+
+    record['Total'] = sum(total)
+    return record
+
+
+# True when the history is kept in the SQLite database. Histories that were
+# never saved there (Hours.csv, other students' folders) stay in CSV.
+def in_database(file_path):
+    if STORAGE_BACKEND != 'sqlite':
+        return False
+    from sqlite_store import has_history
+    return has_history(file_path)
+
+
+# True when the history is kept as a change log (see event_log.py)
+def in_event_log(file_path):
+    if STORAGE_BACKEND != 'events':
+        return False
+    from event_log import has_log
+    return has_log(file_path)
+
+
+def add_save_listener(listener):
+    if listener not in _save_listeners:
+        _save_listeners.append(listener)
+
+
+def _saved(file_path):
+    invalidate(file_path)
+    for listener in _save_listeners:
+        listener(file_path)
+
+
+# Part of a history's cache fingerprint that lives in the database or the
+# log. In the database it covers one student's snapshots (all if None).
+def database_version(file_path, student=None):
+    if STORAGE_BACKEND == 'events':
+        from event_log import log_path
+        return (file_fingerprint(log_path(file_path)),)
+    if STORAGE_BACKEND != 'sqlite':
+        return ()
+    from sqlite_store import history_version
+    return (history_version(file_path, student), student)
+
+
+# cells, with the events backend, is what the log keeps instead of record.
+# student only applies to the SQLite backend (DEFAULT_STUDENT if None).
+@timed
+def save_record(file_path, record, value_column, cells=None, student=None):
+    if STORAGE_BACKEND == 'sqlite':
+        from sqlite_store import append_record as append_to_database
+        append_to_database(file_path, record, student)
+    elif STORAGE_BACKEND == 'events':
+        from event_log import save_records
+        save_records(file_path, [record], value_column, None if cells is None else [cells])
+    else:
+        group_commit(file_path, record, value_column)
+    _saved(file_path)
+
+
+# Bulk save of a frame of rows, e.g. from an import: one lock and one fsync
+# (or one transaction) for all of them. Columns with no value are left out.
+@timed
+def save_frame(file_path, frame, value_column, student=None):
+    frame = frame.dropna(axis=1, how='all')
+    if STORAGE_BACKEND == 'sqlite':
+        from sqlite_store import append_records as append_to_database
+        append_to_database(file_path, frame.to_dict('records'), student)
+    elif STORAGE_BACKEND == 'events':
+        from event_log import save_records
+        save_records(file_path, frame, value_column)
+    else:
+        with file_lock(file_path):
+            append_with_aggregates(file_path, frame, value_column, append_frame)
+    _saved(file_path)
+
+
+def save_grades(subjects, grades, final_gpa, file_path=GRADES_CSV_PATH, student=None):
+    save_record(file_path, grades_record(subjects, grades, final_gpa), 'GPA', student=student)
+
+
+# The events backend logs the marks and hours, not their products
+def save_marks_hours(subjects, marks, hours, file_path=MARKS_HOURS_CSV_PATH, student=None):
+    record = marks_hours_record(subjects, marks, hours)
+    cells = None
+    if STORAGE_BACKEND == 'events':
+        from event_log import marks_hours_cells
+        cells = marks_hours_cells(subjects, marks, hours, record['Date/Time'])
+    save_record(file_path, record, 'Total', cells, student)
+
+
+# The main history file followed by the timestamped shards older
+# versions created on schema changes (e.g. Grades_20240101_120000.csv)
+def history_files(file_path):
+    stem, ext = os.path.splitext(file_path)
+    shards = sorted(glob.glob(f'{glob.escape(stem)}_*{ext}'))
+    return ([file_path] if os.path.exists(file_path) else []) + shards
+
+
+# Load a history and all of its shards as one table ordered by date,
+# optionally parsing only some of the columns
+@timed
+def read_csv_history(file_path, columns=None):
+    paths = history_files(file_path)
+    if not paths:
+        raise FileNotFoundError(file_path)
+    if instrumentation_enabled():
+        count('bytes_read', sum(os.path.getsize(path) for path in paths))
+
+    # pandas is only loaded once a history is read, saving never needs it
+    import pandas as pd
+    usecols = None if columns is None else (lambda c: c in columns)
+    frames = [pd.read_csv(path, usecols=usecols) for path in paths]
+    header = []
+    for frame in frames:
+        header = evolve_header(header, list(frame.columns))
+
+    history = pd.concat(frames, ignore_index=True)[header]
+    if 'Date/Time' in history.columns and len(frames) > 1:
+        history = history.sort_values('Date/Time', kind='stable', ignore_index=True)
+    return history
+
+
+# Load a history from whichever backend holds it, optionally only some
+# columns and the snapshots between two 'YYYY-MM-DD' dates (inclusive).
+# In the database, student picks one student's snapshots (all if None).
+def load_history(file_path, columns=None, start=None, end=None, student=None):
+    if in_database(file_path):
+        from sqlite_store import load_history as load_from_database
+        return load_from_database(file_path, columns, start, end, student)
+    if in_event_log(file_path):
+        from event_log import load_history as load_from_log
+        return load_from_log(file_path, columns, start, end)
+
+    history = read_csv_history(file_path, columns)
+    if (start is not None or end is not None) and 'Date/Time' in history.columns:
+        import pandas as pd
+        dates = history['Date/Time'].astype(str)
+        keep = (dates >= str(start)) if start is not None else pd.Series(True, index=history.index)
+        if end is not None:
+            keep &= dates <= str(end)
+        history = history[keep].reset_index(drop=True)
+    return history
+
+
+# Fold the shards back into the main history file and remove them
+def merge_shards(file_path):
+    paths = history_files(file_path)
+    if paths in ([], [file_path]):
+        return
+    history = read_csv_history(file_path)
+    tmp_path = file_path + '.tmp'
+    history.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, file_path)
+    for path in paths:
+        if path != file_path:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    merge_shards(GRADES_CSV_PATH)
+    merge_shards(MARKS_HOURS_CSV_PATH)
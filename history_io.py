@@ -0,0 +1,195 @@
+import argparse
+import csv
+import json
+import os
+import numpy as np
+import pandas as pd
+from batch_gpa import MAX_MARK, MIN_MARK, load_preset
+from grade_store import (GRADES_CSV_PATH, MARKS_HOURS_CSV_PATH, evolve_header, history_files, in_database,
+                         in_event_log, load_history, read_header, save_frame)
+
+# Rows parsed per chunk, memory stays flat whatever the file size
+CHUNK_ROWS = 50000
+
+DATE_COLUMN = 'Date/Time'
+
+
+def input_format(path, file_format=None):
+    file_format = file_format or ('jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson') else 'csv')
+    if file_format not in ('csv', 'jsonl'):
+        raise ValueError(f"Unknown format {file_format}, use csv or jsonl.")
+    return file_format
+
+
+def read_chunks(path, file_format=None, chunk_rows=CHUNK_ROWS):
+    if input_format(path, file_format) == 'jsonl':
+        return pd.read_json(path, lines=True, chunksize=chunk_rows, dtype=False)
+    return pd.read_csv(path, chunksize=chunk_rows)
+
+
+# "Source=Subject" pairs from the command line
+def parse_mapping(pairs):
+    mapping = {}
+    for pair in pairs or []:
+        source, _, subject = pair.partition('=')
+        if not source or not subject:
+            raise ValueError(f"Mapping '{pair}' must look like Source=Subject.")
+        mapping[source] = subject
+    return mapping
+
+
+# Grades and Marks_Hours rows for one chunk of snapshots, plus the rejected
+# rows with a reason. Dates are ISO 8601 (YYYY-MM-DD, time optional). A
+# blank mark means the subject was not taken yet, as in history rows saved
+# before a subject was added; the GPA then covers the subjects that have a
+# mark. A mark that is there but is not a number rejects the row.
+def convert_chunk(chunk, subjects, hours, mapping=None, date_column=DATE_COLUMN):
+    chunk = chunk.rename(columns=mapping or {})
+    cells = chunk.reindex(columns=subjects)
+    marks = cells.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    present = ~np.isnan(marks)
+    unparsed = ~present & cells.notna().to_numpy()
+    if unparsed.any():
+        rows, columns = np.nonzero(unparsed)
+        blank = np.array([isinstance(cell, str) and not cell.strip()
+                          for cell in cells.to_numpy()[rows, columns]], dtype=bool)
+        unparsed[rows[blank], columns[blank]] = False
+
+    if date_column in chunk.columns:
+        dates = pd.to_datetime(chunk[date_column], errors='coerce', format='ISO8601')
+    else:
+        dates = pd.Series(pd.Timestamp.now().normalize(), index=chunk.index)
+
+    reasons = np.full(len(chunk), '', dtype=object)
+    reasons[~present.any(axis=1)] = 'no marks'
+    reasons[(present & ((marks < MIN_MARK) | (marks > MAX_MARK))).any(axis=1)] = \
+        f'mark outside {MIN_MARK}-{MAX_MARK}'
+    reasons[unparsed.any(axis=1)] = 'non-numeric mark'
+    reasons[dates.isna().to_numpy()] = 'bad date'
+    valid = reasons == ''
+
+    marks, present = marks[valid], present[valid]
+    row_hours = np.where(present, hours, 0)
+    mark_hours = np.where(present, marks * hours, np.nan)
+    dates = dates[valid].dt.strftime('%Y-%m-%d').to_numpy()
+
+    grades = pd.DataFrame(marks, columns=subjects)
+    grades.insert(0, 'GPA', np.nansum(mark_hours, axis=1) / row_hours.sum(axis=1))
+    grades.insert(0, 'Date/Time', dates)
+    marks_hours = pd.DataFrame(mark_hours, columns=subjects)
+    marks_hours.insert(0, 'Date/Time', dates)
+    marks_hours['Total'] = np.nansum(mark_hours, axis=1)
+
+    rejected = chunk[~valid].assign(Reason=reasons[~valid])
+    return grades, marks_hours, rejected
+
+
+# Whole-number columns are written as integers, like the form saves them
+def _integral(frame, columns):
+    for column in columns:
+        values = frame[column].dropna()
+        if (values == values.round()).all():
+            frame[column] = frame[column].astype('Int64')
+    return frame
+
+
+# Stream snapshots from a CSV or JSON-lines file into the two histories the
+# dashboard reads, one chunk (one lock and fsync per file) at a time
+def import_history(path, preset_path, mapping=None, date_column=DATE_COLUMN, file_format=None,
+                   chunk_rows=CHUNK_ROWS, grades_path=GRADES_CSV_PATH, marks_hours_path=MARKS_HOURS_CSV_PATH,
+                   rejects_path=None):
+    subjects, hours = load_preset(preset_path)
+    imported = rejected_count = 0
+    rejects = None
+    try:
+        for chunk in read_chunks(path, file_format, chunk_rows):
+            grades, marks_hours, rejected = convert_chunk(chunk, subjects, hours, mapping, date_column)
+            if len(grades):
+                save_frame(grades_path, _integral(grades, subjects), 'GPA')
+                save_frame(marks_hours_path, _integral(marks_hours, subjects + ['Total']), 'Total')
+            if len(rejected) and rejects_path:
+                if rejects is None:
+                    rejects = open(rejects_path, 'w', newline='')
+                    rejected.to_csv(rejects, index=False)
+                else:
+                    rejected.to_csv(rejects, header=False, index=False)
+            imported += len(grades)
+            rejected_count += len(rejected)
+    finally:
+        if rejects is not None:
+            rejects.close()
+    return imported, rejected_count
+
+
+# Stream a history out as CSV or JSON lines. CSV histories are read chunk by
+# chunk (main file, then any shards); SQLite histories and event logs are read
+# in one go.
+def export_history(file_path, output_path, file_format=None, chunk_rows=CHUNK_ROWS):
+    file_format = input_format(output_path, file_format)
+    if in_database(file_path) or in_event_log(file_path):
+        chunks = [load_history(file_path)]
+        header = list(chunks[0].columns)
+    else:
+        paths = history_files(file_path)
+        if not paths:
+            raise FileNotFoundError(file_path)
+        # Shards may have fewer subjects; the header is read up front so every
+        # chunk is written under the same columns
+        header = []
+        for path in paths:
+            header = evolve_header(header, read_header(path))
+        chunks = (chunk for path in paths for chunk in pd.read_csv(path, chunksize=chunk_rows))
+
+    exported = 0
+    with open(output_path, 'w', newline='') as f:
+        if file_format == 'csv':
+            csv.writer(f).writerow(header)
+        for chunk in chunks:
+            if file_format == 'jsonl':
+                for row in chunk.to_dict('records'):
+                    f.write(json.dumps({k: v for k, v in row.items() if not (isinstance(v, float) and np.isnan(v))},
+                                       default=lambda v: v.item()) + '\n')
+            else:
+                chunk.reindex(columns=header).to_csv(f, header=False, index=False)
+            exported += len(chunk)
+    return exported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import or export grade histories.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    importer = commands.add_parser('import', help="Import snapshots into Grades.csv and Marks_Hours.csv")
+    importer.add_argument('preset', help="Class-Templates preset JSON file with the subjects and hours")
+    importer.add_argument('input', help="CSV or JSON-lines file, one snapshot per row")
+    importer.add_argument('--map', action='append', dest='mapping', metavar='SOURCE=SUBJECT',
+                          help="Read the SOURCE column as the preset subject SUBJECT")
+    importer.add_argument('--date-column', default=DATE_COLUMN, help="Snapshot date column (default: today)")
+    importer.add_argument('--format', choices=['csv', 'jsonl'], help="Input format (default: from the extension)")
+    importer.add_argument('--rejects', help="Write the rejected rows and the reason to this CSV file")
+    importer.add_argument('--grades', default=GRADES_CSV_PATH)
+    importer.add_argument('--marks-hours', default=MARKS_HOURS_CSV_PATH)
+    importer.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+
+    exporter = commands.add_parser('export', help="Export a history as CSV or JSON lines")
+    exporter.add_argument('output', help="Output file")
+    exporter.add_argument('--history', default=GRADES_CSV_PATH, help="History to export (default: Grades.csv)")
+    exporter.add_argument('--format', choices=['csv', 'jsonl'], help="Output format (default: from the extension)")
+    exporter.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'import':
+            imported, rejected = import_history(args.input, args.preset, parse_mapping(args.mapping),
+                                                args.date_column, args.format, args.chunk_rows, args.grades,
+                                                args.marks_hours, args.rejects)
+            print(f"Imported {imported} snapshots, rejected {rejected}.")
+        else:
+            exported = export_history(args.history, args.output, args.format, args.chunk_rows)
+            print(f"Exported {exported} snapshots to {args.output}.")
+    except (FileNotFoundError, ValueError) as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import os
 
-deps = ['streamlit', 'pandas','plotly']
+deps = ['streamlit', 'pandas','plotly', 'numpy']
 
 os.system("pip install uv")
 
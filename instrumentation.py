@@ -0,0 +1,154 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+# GPA_TRACE=1 turns timing on, GPA_TRACE_FILE=path also writes every span
+# to a JSON-lines file. When off, timed functions cost one flag check.
+TRACE_FILE = os.environ.get('GPA_TRACE_FILE')
+_enabled = bool(os.environ.get('GPA_TRACE') or TRACE_FILE)
+
+_lock = threading.Lock()
+_totals = {}
+_counters = {}
+_trace = None
+
+# Spans and counters of the rerun running on this thread (one Streamlit
+# session runs its script on one thread at a time)
+_local = threading.local()
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def enabled():
+    return _enabled
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def reset():
+    with _lock:
+        _totals.clear()
+        _counters.clear()
+
+
+def start_run():
+    _local.spans = []
+    _local.counters = {}
+    _local.depth = 0
+
+
+def _write_trace(entry):
+    global _trace
+    if _trace is None:
+        _trace = open(TRACE_FILE, 'a', buffering=1)
+    _trace.write(json.dumps(entry) + '\n')
+
+
+def _record(name, started, seconds, depth):
+    with _lock:
+        total = _totals.setdefault(name, [0, 0.0, 0.0])
+        total[0] += 1
+        total[1] += seconds
+        total[2] = max(total[2], seconds)
+        if TRACE_FILE:
+            _write_trace({'ts': time.time(), 'name': name, 'ms': seconds * 1000, 'depth': depth,
+                          'thread': threading.current_thread().name, 'pid': os.getpid()})
+    spans = getattr(_local, 'spans', None)
+    if spans is not None:
+        spans.append((started, depth, name, seconds))
+
+
+class Span:
+    __slots__ = ('name', 'started', 'depth')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.depth = getattr(_local, 'depth', 0)
+        _local.depth = self.depth + 1
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.started
+        _local.depth = self.depth
+        _record(self.name, self.started, seconds, self.depth)
+        return False
+
+
+# with span('build chart'): ...
+def span(name):
+    return Span(name) if _enabled else _NULL_SPAN
+
+
+# @timed or @timed(name='...'): time every call of the function
+def timed(func=None, *, name=None):
+    def decorate(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate(func) if func is not None else decorate
+
+
+# count('bytes_read', n): process-wide and per-rerun counters
+def count(name, amount=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+    counters = getattr(_local, 'counters', None)
+    if counters is not None:
+        counters[name] = counters.get(name, 0) + amount
+
+
+def totals():
+    with _lock:
+        return ({name: {'calls': calls, 'total_ms': seconds * 1000, 'mean_ms': seconds * 1000 / calls,
+                        'max_ms': longest * 1000}
+                 for name, (calls, seconds, longest) in _totals.items()},
+                dict(_counters))
+
+
+# Spans of the current rerun in start order, indented by nesting
+def run_report():
+    spans = sorted(getattr(_local, 'spans', []))
+    return ([{'Step': '  ' * depth + name, 'ms': seconds * 1000} for _, depth, name, seconds in spans],
+            dict(getattr(_local, 'counters', {})))
+
+
+# Sidebar panel with the timings of this rerun and of the whole process
+def render_debug_panel():
+    if not _enabled:
+        return
+    import pandas as pd
+    import streamlit as st
+
+    with st.sidebar.expander("Timings", expanded=False):
+        steps, counters = run_report()
+        st.write("This rerun")
+        st.dataframe(pd.DataFrame(steps, columns=['Step', 'ms']), hide_index=True)
+        for name, value in counters.items():
+            st.write(f"{name}: {value:,}")
+
+        process_totals, process_counters = totals()
+        st.write("Since the server started")
+        st.dataframe(pd.DataFrame.from_dict(process_totals, orient='index').sort_values('total_ms',
+                                                                                         ascending=False)
+                     if process_totals else pd.DataFrame())
+        for name, value in process_counters.items():
+            st.write(f"{name}: {value:,}")
+        if st.button("Reset timings"):
+            reset()
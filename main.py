@@ -1,6 +1,42 @@
+import os
 from gpa_functions import *
+from instrumentation import render_debug_panel, start_run, timed
+
+
+# Single table editor for long subject lists, the GPA is updated from the edited cells only
+@timed
+def grid_editor(num_subjects):
+    # numpy and pandas are only loaded when the grid editor is used
+    from grade_grid import GradeGrid
+
+    grid = st.session_state.get('grade_grid')
+    if grid is None or len(grid.marks) != num_subjects:
+        grid = GradeGrid(st.session_state.subjects[:num_subjects],
+                         st.session_state.grades[:num_subjects],
+                         st.session_state.hours[:num_subjects])
+        st.session_state.grade_grid = grid
+        st.session_state.grid_version = st.session_state.get('grid_version', 0) + 1
+
+    key = f"grade_grid_{st.session_state.grid_version}"
+    st.data_editor(grid.base_frame, key=key, num_rows="fixed", use_container_width=True, hide_index=True,
+                   column_config={
+                       'Subject': st.column_config.TextColumn("Subject"),
+                       'Marks': st.column_config.NumberColumn("Marks", min_value=0, max_value=100, step=1),
+                       'Hours': st.column_config.NumberColumn("Hours", min_value=1, max_value=12, step=1)
+                   })
+    grid.apply_edits(st.session_state.get(key, {}).get('edited_rows', {}))
+    return grid
+
+
 def main():
+    start_run()
+    # Saves from this page refresh the Analytics results in the background
+    # (precompute loads the table readers, so it is only imported when on)
+    if os.environ.get('GPA_PRECOMPUTE'):
+        from precompute import start
+        start()
     st.title("GPA Calculator")
+    student = session_student()
 
     # Preset management
     st.sidebar.header("Manage Presets")
@@ -19,8 +55,10 @@ def main():
             st.session_state.selected_preset = preset_name
             st.success(f"Preset '{preset_name}' loaded successfully!")
 
-    # Preset selection
-    preset_name = st.sidebar.radio("Select or Create Preset:", list(st.session_state.presets.keys()), index=list(st.session_state.presets.keys()).index(st.session_state.selected_preset))
+    # Preset selection, session presets first then the indexed Class-Templates
+    preset_names = list(st.session_state.presets.keys())
+    preset_names += [name for name in get_registry().names() if name not in st.session_state.presets]
+    preset_name = st.sidebar.radio("Select or Create Preset:", preset_names, index=preset_names.index(st.session_state.selected_preset))
     st.session_state.selected_preset = preset_name
     apply_preset(preset_name)
 
@@ -36,45 +74,59 @@ def main():
     if len(st.session_state.grades) < num_subjects:
         st.session_state.grades.extend([0 for _ in range(len(st.session_state.grades), num_subjects)])
 
-    total = []
+    grid_mode = st.sidebar.checkbox("Grid editor (for many subjects)")
 
-    for i in range(num_subjects):
-        subject_name = st.text_input(f"Enter the name of subject {i + 1} (optional): ",
-                                     value=st.session_state.subjects[i] if i < len(st.session_state.subjects) else "",
-                                     key=f"subject_name_{i}")
-
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            default_marks = st.session_state.grades[i] if i < len(st.session_state.grades) else 0
-            marks = st.number_input(f"Enter the marks of {subject_name}: ", min_value=0, max_value=100,
-                                    value=default_marks,
-                                    key=f"marks_{i}")
-        with col2:
-            default_hour = st.session_state.hours[i] if i < len(st.session_state.hours) else 1
-            hour = st.number_input(f"Hours", min_value=1, max_value=12,
-                                   value=default_hour,
-                                   key=f"hours_{i}")
-        st.session_state.subjects[i] = subject_name
-        st.session_state.hours[i] = hour
-        st.session_state.grades[i] = marks
-
-        st.markdown("---")
-
-        if marks > 0 and hour > 0:
-            total.append(marks * hour)
-        else:
+    if grid_mode:
+        grid = grid_editor(num_subjects)
+        if grid.zero_marks:
             st.error("Invalid input. Please enter positive numbers.")
+        subjects, grades, hours = grid.as_lists()
+        st.session_state.subjects[:num_subjects] = subjects
+        st.session_state.grades[:num_subjects] = grades
+        st.session_state.hours[:num_subjects] = hours
+    else:
+        # The form owns the marks now; the grid is rebuilt from them when turned back on
+        st.session_state.pop('grade_grid', None)
+        total = []
+
+        for i in range(num_subjects):
+            subject_name = st.text_input(f"Enter the name of subject {i + 1} (optional): ",
+                                         value=st.session_state.subjects[i] if i < len(st.session_state.subjects) else "",
+                                         key=f"subject_name_{i}")
+
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                default_marks = st.session_state.grades[i] if i < len(st.session_state.grades) else 0
+                marks = st.number_input(f"Enter the marks of {subject_name}: ", min_value=0, max_value=100,
+                                        value=default_marks,
+                                        key=f"marks_{i}")
+            with col2:
+                default_hour = st.session_state.hours[i] if i < len(st.session_state.hours) else 1
+                hour = st.number_input(f"Hours", min_value=1, max_value=12,
+                                       value=default_hour,
+                                       key=f"hours_{i}")
+            st.session_state.subjects[i] = subject_name
+            st.session_state.hours[i] = hour
+            st.session_state.grades[i] = marks
+
+            st.markdown("---")
+
+            if marks > 0 and hour > 0:
+                total.append(marks * hour)
+            else:
+                st.error("Invalid input. Please enter positive numbers.")
 
     if len(st.session_state.hours) > 0:
-        final_gpa = sum(total) / sum(st.session_state.hours)
+        final_gpa = grid.gpa if grid_mode else sum(total) / sum(st.session_state.hours)
         st.success(f"Your GPA is: {final_gpa:.2f}")
 
         # Save and download preset buttons
         col1, col2 = st.columns([1, 1])
         with col1:
             if st.button('Save Grades and GPA'):
-                save_grades_to_csv(st.session_state.subjects, st.session_state.grades, final_gpa)
-                save_marks_hours_to_csv(st.session_state.subjects, st.session_state.grades, st.session_state.hours)
+                save_grades_to_csv(st.session_state.subjects, st.session_state.grades, final_gpa, student)
+                save_marks_hours_to_csv(st.session_state.subjects, st.session_state.grades, st.session_state.hours,
+                                        student)
         with col2:
             preset_json = save_preset_to_file(st.session_state.selected_preset, st.session_state.subjects, st.session_state.hours, num_subjects)
             st.sidebar.download_button(
@@ -86,3 +138,5 @@ def main():
 
     else:
         st.warning("No subjects entered. Please add at least one subject.")
+
+    render_debug_panel()
@@ -1,58 +1,46 @@
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
 import os
 import json
-import random
-
-
-def final_exam_mark_estimation(start, finish, hour, mark):
-    # Ensure valid range
-    if start > finish:
-        raise ValueError("Start should be less than or equal to finish.")
-
-    # Calculate range size
-    range_size = finish - start + 1
-
-    # Calculate weights for each number in the range
-    weights = []
-    for i in range(start, finish + 1):
-        # For higher hours, give more weight to lower numbers
-        # For lower hours, give more weight to higher numbers
-        weight = 1 / (abs(i - start) + 1) if hour > (finish - start) / 2 else 1 / (abs(finish - i) + 1)
-        weights.append(weight)
-
-    # Normalize weights
-    total_weight = sum(weights)
-    normalized_weights = [w / total_weight for w in weights]
-
-    # Select a number based on the weighted distribution
-    selected_number = random.choices(range(start, finish + 1), weights=normalized_weights, k=1)[0]
-    selected_number = mark - selected_number
-    return selected_number
-
-
-def final_grade(grade, final, hour, type):
-    if type == 'f4':
-        result = ((grade / 100) * 60 + final) * hour
-        return result
-    elif type == 'f5':
-        result = ((grade / 100) * 50 + final) * hour
-        return result
-    else:
-        return 'Wrong Type'
+from data_cache import cached, history_fingerprint
+from grade_aggregates import average, current_aggregates
+from grade_store import load_history
+from gpa_functions import session_student
+from charts import band_chart, heatmap_chart
+from goal_solver import goal_table
+from estimation import final_exam_mark_estimation, simulate_final_gpa_series, make_rng
+from instrumentation import render_debug_panel, span, start_run, timed
+from precompute import (MARKS_HOURS_COLUMNS, compact_history, estimation_key as make_estimation_key, final_gpa_chart,
+                        final_gpa_table, grades_chart, inputs_key as make_inputs_key, load_cached_table, remember_view,
+                        start_if_enabled, sweep_key as make_sweep_key, sweep_limit, sweep_table, trend)
+from trends import WINDOW_DAYS, default_final_date
+
+# Draw count above which the simulation is split across processes
+SIMULATION_POOL_DRAWS = 500000
 
 
 # Load data from a file
-def load_data(file_path):
+@timed
+def load_data(file_path, loader=pd.read_csv):
     try:
-        return pd.read_csv(file_path)
+        return loader(file_path)
     except FileNotFoundError:
         st.error("File not found. Please upload the required files.")
         st.stop()
 
 
+# Snapshots of a history between two dates (either may be None) for the
+# table view. With SQLite only those rows are read from the database.
+@timed
+def load_date_range(file_path, since, until, student):
+    since = None if since is None else f'{since:%Y-%m-%d}'
+    until = None if until is None else f'{until:%Y-%m-%d}'
+    return cached(('date range', history_fingerprint(file_path, student), since, until),
+                  lambda: load_history(file_path, start=since, end=until, student=student))
+
+
 # Convert a JSON preset to CSV
+@timed
 def convert_json_to_csv(json_data, csv_file_path):
     data = json.loads(json_data)
     subjects = data['subjects']
@@ -66,38 +54,12 @@ def convert_json_to_csv(json_data, csv_file_path):
     df.to_csv(csv_file_path, index=False)
 
 
-# Calculate GPA average from Grades data
-def calculate_gpa_average(grades_data):
-    total_sum = grades_data['GPA'].sum()
-    num_entries = len(grades_data)
-    gpa_average = total_sum / num_entries if num_entries > 0 else 0
-    return gpa_average
-
-
-def calculate_final_gpa(row, hours_row, start, finish, subjects_for_50, hour_df):
-    total_sum = 0
-    total_hours = 0  # To accumulate hours used for weighting
-    for subject, grade, hour in zip(row.index[2:], row[2:], hours_row):
-        # Correct weightage assignment
-        subject_type = 'f5' if subject in subjects_for_50 else 'f4'
-
-        # Estimate the final exam mark based on the subject type
-        final_exam = final_exam_mark_estimation(start, finish, hour, 50 if subject_type == 'f5' else 40)
-
-        # Calculate the final GPA for the subject
-        final_gpa = final_grade(grade, final_exam, hour, subject_type)
-
-        # Accumulate the weighted GPA
-        total_sum += final_gpa
-        total_hours += hour  # Accumulate the total hours for normalization
-
-    gpa = total_sum / total_hours if total_hours != 0 else 0
-    return gpa
-
-
 # Main function
 def main():
+    start_run()
+    start_if_enabled()
     st.title("Analytics Dashboard")
+    student = session_student()
 
     # File paths
     base_csv_dir = 'csv/mark_hours/'
@@ -114,10 +76,23 @@ def main():
             convert_json_to_csv(json_data, hours_csv_path)
             st.sidebar.success('Preset JSON has been converted to CSV and saved.')
 
-    # Load data for both CSV files
-    grades_data = load_data(grades_csv_path)
-    marks_hours_data = load_data(os.path.join(base_csv_dir, 'Marks_Hours.csv'))
-    hours_data = load_data(hours_csv_path)
+    # Derived tables are cached on the files they come from (taken before the
+    # files are read, like the precompute worker does)
+    inputs_key = make_inputs_key(grades_csv_path, hours_csv_path, student)
+    grades_key = inputs_key[0]
+
+    # Load data for both CSV files, parsed tables are reused while the files are unchanged.
+    # Only the Total column of Marks_Hours is read unless the table is shown.
+    marks_hours_csv_path = os.path.join(base_csv_dir, 'Marks_Hours.csv')
+    grades_data = load_data(grades_csv_path, lambda path: load_cached_table(path, student=student))
+    marks_hours_data = load_data(marks_hours_csv_path,
+                                 lambda path: load_cached_table(path, MARKS_HOURS_COLUMNS, student))
+    hours_data = load_data(hours_csv_path, load_cached_table)
+    if 'GPA' not in grades_data.columns:
+        st.info("No grades saved yet for this student.")
+        st.stop()
+    # Typed arrays of the Grades history for the charts and the estimation
+    history = compact_history(inputs_key, grades_data, hours_data)
 
     # Select subjects that are 50-weighted
     subjects = list(hours_data.columns)
@@ -130,31 +105,54 @@ def main():
     start = st.sidebar.number_input("Minimum mistakes in finals", min_value=0)
     finish = st.sidebar.number_input("Maximum mistakes in finals", min_value=1)
 
-    # Calculate GPA over time for final estimation
-    gpa_over_time = []
-    for index, row in grades_data.iterrows():
-        timestamp = row['Date/Time']
-        hours_row = hours_data.iloc[0].values
-        gpa = calculate_final_gpa(row, hours_row, start, finish, subjects_for_50,hours_csv_path)
-        gpa_over_time.append((timestamp, gpa))
+    # Fixed seed keeps the estimation stable across widget interactions
+    seed = st.sidebar.number_input("Estimation seed", min_value=0, value=0, step=1)
+    rng = make_rng(seed)
+
+    # Monte Carlo mode shows the spread of the final GPA instead of one draw
+    simulate = st.sidebar.checkbox("Monte Carlo estimation")
+    draws = st.sidebar.number_input("Simulated draws", min_value=1000, max_value=1000000, value=10000, step=1000,
+                                    disabled=not simulate)
 
-    gpa_df = pd.DataFrame(gpa_over_time, columns=['Date/Time', 'GPA'])
-    gpa_df['Date/Time'] = pd.to_datetime(gpa_df['Date/Time'])
+    # Rolling statistics window and the date the trend forecast runs to
+    window_days = st.sidebar.number_input("Trend window (days)", min_value=2, value=WINDOW_DAYS, step=1)
+    final_date = st.sidebar.date_input("Final exam date", value=default_final_date())
 
-    # Calculate GPA Average from Grades data
-    gpa_average = calculate_gpa_average(grades_data)
+    # Calculate GPA over time for final estimation, all snapshots in one batch
+    # (already in the cache when the precompute worker refreshed this view)
+    estimation_key = make_estimation_key(inputs_key, subjects_for_50, start, finish, seed)
+    gpa_df = final_gpa_table(estimation_key, history, subjects_for_50, start, finish, seed)
+    remember_view(subjects_for_50, start, finish, seed, grade_goal, window_days, final_date, student)
+
+    # GPA Average and trends from the running totals kept next to Grades.csv
+    gpa_average = average(current_aggregates(grades_csv_path, 'GPA', student))
+    trend_summary = trend(grades_key, grades_csv_path, window_days, final_date, student)
 
     # Table selection dropdown
     file_choice = st.selectbox("Choose table to view:", ["Grades.csv", "Marks_Hours.csv", "Hours.csv"])
 
+    # The history tables can be narrowed to the snapshots between two dates
+    if file_choice != "Hours.csv":
+        col1, col2 = st.columns([1, 1])
+        since = col1.date_input("Snapshots from", value=None, key="table_since")
+        until = col2.date_input("Snapshots to", value=None, key="table_until")
+        narrowed = since is not None or until is not None
+
     if file_choice == "Grades.csv":
         st.subheader("Grades Table")
         st.write(f"GPA Average: {gpa_average:.2f}")
-        st.dataframe(grades_data, height=400)
+        if narrowed:
+            st.dataframe(load_date_range(grades_csv_path, since, until, student), height=400)
+        else:
+            st.dataframe(grades_data, height=400)
     elif file_choice == "Marks_Hours.csv":
         st.subheader("Totals Table")
         st.write(f"GPA Average: {gpa_average:.2f}")
-        st.dataframe(marks_hours_data, height=400)
+        if narrowed:
+            st.dataframe(load_date_range(marks_hours_csv_path, since, until, student), height=400)
+        else:
+            st.dataframe(load_data(marks_hours_csv_path, lambda path: load_cached_table(path, student=student)),
+                         height=400)
     elif file_choice == "Hours.csv":
         st.subheader("Hours Table")
         st.write(f"GPA Average: {gpa_average:.2f}")
@@ -166,65 +164,35 @@ def main():
     with col3:
         st.subheader("Grades Over Time")
         if 'Date/Time' in grades_data.columns:
-            grades_data['Date/Time'] = pd.to_datetime(grades_data['Date/Time'])
-
-            fig = go.Figure()
-
-            # Plot grade goal
-            fig.add_trace(go.Scatter(
-                x=grades_data['Date/Time'],
-                y=[grade_goal] * len(grades_data),
-                mode='lines',
-                name='Grade Goal',
-                line=dict(color='red', dash='dash')
-            ))
-
-            # Plot GPA over time
-            fig.add_trace(go.Scatter(
-                x=grades_data['Date/Time'],
-                y=grades_data['GPA'],
-                mode='lines',
-                name='GPA',
-                line=dict(color='blue'),
-                marker=dict(color='blue', size=8)
-            ))
-
-            # Add shaded areas
-            fig.add_trace(go.Scatter(
-                x=pd.concat([grades_data['Date/Time'], grades_data['Date/Time'][::-1]]),
-                y=pd.concat([grades_data['GPA'], pd.Series([grade_goal] * len(grades_data))[::-1]]),
-                fill='tozeroy',
-                fillcolor='rgba(0, 0, 255, 0.2)',  # Blue fill for above goal
-                line=dict(color='rgba(255, 255, 255, 0)'),  # Transparent line
-                showlegend=False
-            ))
-
-            fig.add_trace(go.Scatter(
-                x=pd.concat([grades_data['Date/Time'], grades_data['Date/Time'][::-1]]),
-                y=pd.concat([pd.Series([grade_goal] * len(grades_data)), grades_data['GPA'][::-1]]),
-                fill='tozeroy',
-                fillcolor='rgba(0, 0, 255, 0.2)',  # Blue fill for below goal
-                line=dict(color='rgba(255, 255, 255, 0)'),  # Transparent line
-                showlegend=False
-            ))
-
-            fig.update_layout(
-                xaxis_title='Date/Time',
-                yaxis_title='GPA',
-                yaxis=dict(range=[max(0, grade_goal - 5), 100]),
-                height=400,
-                showlegend=True
-            )
-
-            st.plotly_chart(fig, use_container_width=True)
+            fig = grades_chart(grades_key, history, grade_goal, trend_summary, window_days, final_date)
+            with span('plot Grades Over Time'):
+                st.plotly_chart(fig, use_container_width=True)
+            gpa_forecast = trend_summary['forecast']
+            if gpa_forecast is not None:
+                st.write(f"Trend forecast for {final_date:%Y-%m-%d}: {gpa_forecast['final']:.2f} "
+                         f"(± {gpa_forecast['spread']:.2f}, {gpa_forecast['slope']:+.3f} per day)")
 
     with col4:
         st.subheader("Grades Weightage")
-        if 'Total' in marks_hours_data.columns:
-            subject_sums = marks_hours_data.iloc[-1, 1:-1]
-            fig = go.Figure(go.Pie(labels=subject_sums.index, values=subject_sums))
-            fig.update_layout(showlegend=False, height=400)
-            st.plotly_chart(fig, use_container_width=True)
+        # Last saved row, from the running totals kept next to Marks_Hours.csv
+        last_row = current_aggregates(marks_hours_csv_path, 'Total', student)['last']
+        if 'Total' in marks_hours_data.columns and last_row is not None:
+            subject_sums = pd.Series({subject: value for subject, value in last_row.items()
+                                      if subject not in ('Date/Time', 'Total')})
+            with span('plot Grades Weightage'):
+                import plotly.graph_objects as go
+                fig = go.Figure(go.Pie(labels=subject_sums.index, values=subject_sums))
+                fig.update_layout(showlegend=False, height=400)
+                st.plotly_chart(fig, use_container_width=True)
+
+    # Moving average, spread and per-subject trend over the last window
+    with st.expander("Trends", expanded=False):
+        rolling = trend_summary['rolling']
+        if len(rolling):
+            latest = rolling.iloc[-1]
+            st.write(f"Last {window_days} days: average {latest['Moving Average']:.2f}, "
+                     f"standard deviation {latest['Rolling Std']:.2f} over {latest['Snapshots']} snapshots.")
+        st.dataframe(trend_summary['slopes'], use_container_width=True, hide_index=True)
 
     # Advance Tweaking Expander
     with st.expander("Advance Tweaking", expanded=False):
@@ -233,80 +201,62 @@ def main():
         final_exam_marks_df = pd.DataFrame({
             'Subject': hours_data.columns,
             'Results': [final_exam_mark_estimation(start, finish, hours_data.loc[0, subject],
-                                                   50 if subject in subjects_for_50 else 40) for subject in
+                                                   50 if subject in subjects_for_50 else 40, rng) for subject in
                         hours_data.columns],
         })
 
-        edited_df = st.data_editor(final_exam_marks_df, use_container_width=True)
-
-        # Update results based on edited values
-        new_start = start  # Maintain original start
-        new_finish = finish  # Maintain original finish
-        edited_df['Results'] = [final_exam_mark_estimation(new_start, new_finish, hours_data.loc[0, subject],
-                                                           50 if subject in subjects_for_50 else 40) for subject in
-                                edited_df['Subject']]
-
-        # Recalculate GPA over time with edited values
-        gpa_over_time = []
-        for index, row in grades_data.iterrows():
-            timestamp = row['Date/Time']
-            hours_row = [hours_data.loc[0, subject] for subject in edited_df['Subject']]
-            gpa = calculate_final_gpa(row, hours_row, new_start, new_finish, subjects_for_50,hours_csv_path)
-            gpa_over_time.append((timestamp, gpa))
-
-        gpa_df = pd.DataFrame(gpa_over_time, columns=['Date/Time', 'GPA'])
-        gpa_df['Date/Time'] = pd.to_datetime(gpa_df['Date/Time'])
+        st.data_editor(final_exam_marks_df, use_container_width=True)
+
+    # Final exam marks needed to reach the goal from the latest snapshot
+    with st.expander("What Do I Need?", expanded=False):
+        if len(grades_data):
+            needed_df, feasible, share = goal_table(history, None, subjects_for_50, grade_goal)
+            if not feasible:
+                st.error(f"A GPA of {grade_goal:.2f} can't be reached even with full marks in every final.")
+            elif share == 0:
+                st.success("The coursework alone already reaches the grade goal.")
+            else:
+                st.write(f"Score {share:.0%} of every final, or split the marks as below.")
+            st.dataframe(needed_df, use_container_width=True)
+
+    # Expected final GPA and goal chance for every mistake range and 50-weighted set
+    with st.expander("Scenario Sweep", expanded=False):
+        if len(grades_data):
+            sweep_max = st.slider("Most mistakes in the sweep", min_value=1, max_value=30, value=sweep_limit(finish))
+            candidates = st.multiselect("Subjects that may be 50-weighted", subjects, default=subjects_for_50)
+            metric = st.radio("Show", ['Goal Probability', 'Expected GPA'], horizontal=True)
+            sweep_key = make_sweep_key(inputs_key, candidates, sweep_max, grade_goal, seed)
+            try:
+                sweep_df = sweep_table(sweep_key, history, candidates, sweep_max, grade_goal, seed)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                with span('plot Scenario Sweep'):
+                    st.plotly_chart(heatmap_chart(sweep_key, sweep_df, metric, grade_goal), use_container_width=True)
+                st.dataframe(sweep_df, use_container_width=True, hide_index=True)
 
     # Final Estimation Chart outside the expander
     st.subheader("Updated Final GPA Estimation")
 
-    fig_final = go.Figure()
-
-    fig_final.add_trace(go.Scatter(
-        x=gpa_df['Date/Time'],
-        y=[grade_goal] * len(gpa_df),
-        mode='lines',
-        name='Grade Goal',
-        line=dict(color='red', dash='dash')
-    ))
-
-    fig_final.add_trace(go.Scatter(
-        x=gpa_df['Date/Time'],
-        y=gpa_df['GPA'],
-        mode='lines',
-        name='Final Estimated GPA',
-        line=dict(color='green'),
-        marker=dict(color='green', size=8)
-    ))
-
-    # Add shaded areas for Final Estimation Chart
-    fig_final.add_trace(go.Scatter(
-        x=pd.concat([gpa_df['Date/Time'], gpa_df['Date/Time'][::-1]]),
-        y=pd.concat([gpa_df['GPA'], pd.Series([grade_goal] * len(gpa_df))[::-1]]),
-        fill='tozeroy',
-        fillcolor='rgba(0, 255, 0, 0.2)',  # Green fill
-        line=dict(color='rgba(255, 255, 255, 0)'),  # Transparent line
-        showlegend=False
-    ))
-
-    fig_final.add_trace(go.Scatter(
-        x=pd.concat([gpa_df['Date/Time'], gpa_df['Date/Time'][::-1]]),
-        y=pd.concat([pd.Series([grade_goal] * len(gpa_df)), gpa_df['GPA'][::-1]]),
-        fill='tozeroy',
-        fillcolor='rgba(0, 255, 0, 0.2)',  # Green fill
-        line=dict(color='rgba(255, 255, 255, 0)'),  # Transparent line
-        showlegend=False
-    ))
-
-    fig_final.update_layout(
-        xaxis_title='Date/Time',
-        yaxis_title='GPA',
-        yaxis=dict(range=[max(0, grade_goal - 5), 100]),
-        height=400,
-        showlegend=True
-    )
-
-    st.plotly_chart(fig_final, use_container_width=True)
+    if simulate:
+        # Only fan out to processes when the draws outweigh the pool start-up
+        workers = (os.cpu_count() or 1) if draws >= SIMULATION_POOL_DRAWS else 1
+        sim_df = cached(('simulation',) + estimation_key + (grade_goal, draws),
+                        lambda: simulate_final_gpa_series(history, None, subjects_for_50, start, finish,
+                                                          grade_goal, draws, rng=make_rng(seed), workers=workers))
+        if len(sim_df):
+            st.write(f"Chance of reaching the goal (latest): {sim_df['Goal Probability'].iloc[-1]:.0%}")
+
+        fig_band = band_chart(estimation_key + (draws,), sim_df['Date/Time'], sim_df['Mean'], sim_df['P5'],
+                              sim_df['P95'], sim_df['Goal Probability'], grade_goal)
+        with span('plot Final GPA Estimation'):
+            st.plotly_chart(fig_band, use_container_width=True)
+    else:
+        fig_final = final_gpa_chart(estimation_key, gpa_df, grade_goal)
+        with span('plot Final GPA Estimation'):
+            st.plotly_chart(fig_final, use_container_width=True)
+
+    render_debug_panel()
 
 
 if __name__ == "__main__":
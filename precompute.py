@@ -0,0 +1,206 @@
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from columnar_store import HOURS_CSV_PATH, load_table
+from data_cache import cached, cached_load, history_fingerprint
+from grade_aggregates import current_aggregates, current_days
+from grade_store import DEFAULT_STUDENT, GRADES_CSV_PATH, MARKS_HOURS_CSV_PATH, add_save_listener
+from instrumentation import timed
+from trends import WINDOW_DAYS, default_final_date, trend_summary
+
+# GPA_PRECOMPUTE=1 starts a worker thread in the Streamlit server that
+# rebuilds what the Analytics page shows after every save. The results go
+# to data_cache under the keys the page uses, so the page only reads them.
+PRECOMPUTE = bool(os.environ.get('GPA_PRECOMPUTE'))
+
+# Saves arriving this close together (Grades then Marks_Hours) are refreshed once
+DEBOUNCE_SECONDS = 0.25
+
+# Analytics settings (50-weighted subjects, start, finish, seed, goal, trend
+# window, final exam date, student) refreshed after a save: the page defaults
+# and the most recently viewed. A final date of None is
+# trends.default_final_date().
+DEFAULT_VIEW = ((), 0, 1, 0, 90.0, WINDOW_DAYS, None, DEFAULT_STUDENT)
+RECENT_VIEWS = 4
+
+_jobs = queue.Queue()
+_views = OrderedDict()
+_lock = threading.Lock()
+_worker = None
+_status = {'refreshes': 0, 'last_ms': None, 'last_error': None}
+
+
+# Derived tables and figures of the Analytics page. The page and the worker
+# both go through these, so a precomputed entry is found under the same key.
+def load_cached_table(file_path, columns=None, student=None):
+    return cached_load(file_path, load_table, columns, student)
+
+
+# The page only needs Marks_Hours in full when the table itself is shown
+MARKS_HOURS_COLUMNS = ['Total']
+
+
+def inputs_key(grades_path=GRADES_CSV_PATH, hours_path=HOURS_CSV_PATH, student=None):
+    return (history_fingerprint(grades_path, student), history_fingerprint(hours_path))
+
+
+def estimation_key(inputs, subjects_for_50, start, finish, seed):
+    return inputs + (tuple(sorted(subjects_for_50)), start, finish, seed)
+
+
+# Grades history as typed arrays (dates parsed once), read by the charts
+# and the estimation code instead of the loaded frame
+def compact_history(inputs, grades_data, hours_data):
+    from compact_history import CompactHistory
+    return cached(('compact', inputs), lambda: CompactHistory.from_frames(grades_data, hours_data))
+
+
+def final_gpa_table(key, history, subjects_for_50, start, finish, seed):
+    from estimation import estimate_final_gpa_series, make_rng
+    return cached(('final_gpa',) + key,
+                  lambda: estimate_final_gpa_series(history, None, subjects_for_50, start, finish, make_rng(seed)))
+
+
+# Rolling statistics and forecast from the per-day totals of the GPA
+def trend(grades_key, grades_path, window_days, final_date, student=None):
+    days = cached(('days', grades_key), lambda: current_days(grades_path, 'GPA', student))
+    return cached(('trend', grades_key, window_days, final_date),
+                  lambda: trend_summary(days, window_days, final_date))
+
+
+def grades_chart(grades_key, history, grade_goal, summary, window_days, final_date):
+    from charts import trend_chart
+    return trend_chart((grades_key, window_days, final_date), history.dates, history.gpa, grade_goal,
+                       summary['rolling'], summary['forecast'])
+
+
+def final_gpa_chart(key, gpa_df, grade_goal):
+    from charts import goal_chart
+    return goal_chart(key, gpa_df['Date/Time'], gpa_df['GPA'], grade_goal, 'Final Estimated GPA', 'green',
+                      'rgba(0, 255, 0, 0.2)')
+
+
+# Scenario sweep with its default sweep limit, the larger of 5 and the finish
+def sweep_limit(finish):
+    return max(int(finish), 5)
+
+
+def sweep_key(inputs, candidates, sweep_max, grade_goal, seed):
+    return inputs + (tuple(sorted(candidates)), sweep_max, grade_goal, seed)
+
+
+def sweep_table(key, history, candidates, sweep_max, grade_goal, seed):
+    from scenario_sweep import scenario_table
+    return cached(('sweep',) + key,
+                  lambda: scenario_table(history, None, grade_goal, sweep_max, candidates, seed=seed,
+                                         workers=os.cpu_count() or 1))
+
+
+# Called by the Analytics page so the next refresh covers what was last viewed
+def remember_view(subjects_for_50, start, finish, seed, grade_goal, window_days, final_date, student=None):
+    view = (tuple(sorted(subjects_for_50)), start, finish, seed, grade_goal, window_days, final_date, student)
+    with _lock:
+        _views[view] = None
+        _views.move_to_end(view)
+        while len(_views) > RECENT_VIEWS:
+            _views.popitem(last=False)
+
+
+# Rebuild the cached results of the Analytics page for the current files.
+# The keys are taken before the tables are read: a save landing in between
+# leaves an entry nobody asks for rather than stale data under a new key.
+@timed(name='precompute.refresh')
+def refresh(grades_path=GRADES_CSV_PATH, marks_hours_path=MARKS_HOURS_CSV_PATH, hours_path=HOURS_CSV_PATH):
+    with _lock:
+        views = [DEFAULT_VIEW] + [view for view in _views if view != DEFAULT_VIEW]
+    for student in dict.fromkeys(view[-1] for view in views):
+        refresh_student(student, [view for view in views if view[-1] == student], grades_path, marks_hours_path,
+                        hours_path)
+
+
+def refresh_student(student, views, grades_path, marks_hours_path, hours_path):
+    inputs = inputs_key(grades_path, hours_path, student)
+    grades_data = load_cached_table(grades_path, student=student)
+    load_cached_table(marks_hours_path, MARKS_HOURS_COLUMNS, student)
+    hours_data = load_cached_table(hours_path)
+    # Nothing to show until the student saves
+    if 'GPA' not in grades_data.columns:
+        return
+    history = compact_history(inputs, grades_data, hours_data)
+    current_aggregates(grades_path, 'GPA', student)
+    current_aggregates(marks_hours_path, 'Total', student)
+
+    for subjects_for_50, start, finish, seed, grade_goal, window_days, final_date, _ in views:
+        final_date = final_date or default_final_date()
+        summary = trend(inputs[0], grades_path, window_days, final_date, student)
+        grades_chart(inputs[0], history, grade_goal, summary, window_days, final_date)
+        key = estimation_key(inputs, subjects_for_50, start, finish, seed)
+        final_gpa_chart(key, final_gpa_table(key, history, subjects_for_50, start, finish, seed), grade_goal)
+        if len(history):
+            from charts import heatmap_chart
+            sweep_max = sweep_limit(finish)
+            sweeps = sweep_key(inputs, subjects_for_50, sweep_max, grade_goal, seed)
+            table = sweep_table(sweeps, history, subjects_for_50, sweep_max, grade_goal, seed)
+            heatmap_chart(sweeps, table, 'Goal Probability', grade_goal)
+
+
+def schedule(file_path=None):
+    _jobs.put(file_path)
+
+
+def _run():
+    while True:
+        _jobs.get()
+        # Wait for the rest of the save, then take every queued job at once
+        time.sleep(DEBOUNCE_SECONDS)
+        taken = 1
+        while True:
+            try:
+                _jobs.get_nowait()
+            except queue.Empty:
+                break
+            taken += 1
+
+        started = time.perf_counter()
+        try:
+            refresh()
+            error = None
+        except FileNotFoundError:
+            # Nothing to show until the Hours preset and a first save exist
+            error = None
+        except Exception as e:
+            error = repr(e)
+        with _lock:
+            _status['refreshes'] += 1
+            _status['last_ms'] = (time.perf_counter() - started) * 1000
+            _status['last_error'] = error
+        for _ in range(taken):
+            _jobs.task_done()
+
+
+# Start the worker once per process and have every save schedule a refresh
+def start():
+    global _worker
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            add_save_listener(schedule)
+            _worker = threading.Thread(target=_run, name='gpa-precompute', daemon=True)
+            _worker.start()
+    return _worker
+
+
+def start_if_enabled():
+    if PRECOMPUTE:
+        start()
+
+
+# Block until every scheduled refresh has finished (benchmarks, scripts)
+def wait_idle():
+    _jobs.join()
+
+
+def status():
+    with _lock:
+        return dict(_status, pending=_jobs.qsize())
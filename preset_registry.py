@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import threading
+
+PRESET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Class-Templates')
+INDEX_FILE = '.preset_index.json'
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Index of the preset files in a directory: name, subject set, total hours
+# and content hash per file, persisted next to the presets. Only files whose
+# mtime or size changed are re-read on refresh, bodies are loaded on demand.
+class PresetRegistry:
+    def __init__(self, preset_dir=PRESET_DIR):
+        self.preset_dir = preset_dir
+        self.index_path = os.path.join(preset_dir, INDEX_FILE)
+        self.files = {}
+        self.by_name = {}
+        self.by_hash = {}
+        self.by_subjects = {}
+        self._bodies = {}
+        self._lock = threading.Lock()
+        self._read_index()
+        self.refresh()
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as f:
+                self.files = json.load(f).get('files', {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.files = {}
+
+    def _write_index(self):
+        tmp_path = self.index_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'files': self.files}, f, indent=1)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            # A read-only deployment still works, it just rescans on start
+            pass
+
+    @staticmethod
+    def _entry(path, stat):
+        with open(path, 'rb') as f:
+            data = f.read()
+        preset_data = json.loads(data)
+        subjects = list(preset_data.get('subjects', []))
+        return {
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'hash': content_hash(data),
+            'num_subjects': preset_data.get('num_subjects', len(subjects)),
+            'subjects': subjects,
+            'total_hours': sum(preset_data.get('hours', []))
+        }
+
+    # Re-read only new or changed files and drop deleted ones
+    def refresh(self):
+        with self._lock:
+            changed = False
+            seen = set()
+            for dir_entry in os.scandir(self.preset_dir):
+                if not dir_entry.name.endswith('.json') or dir_entry.name.startswith('.'):
+                    continue
+                seen.add(dir_entry.name)
+                stat = dir_entry.stat()
+                entry = self.files.get(dir_entry.name)
+                if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+                    continue
+                try:
+                    self.files[dir_entry.name] = self._entry(dir_entry.path, stat)
+                except (OSError, ValueError):
+                    self.files.pop(dir_entry.name, None)
+                    continue
+                self._bodies.pop(dir_entry.name, None)
+                changed = True
+
+            for file_name in set(self.files) - seen:
+                del self.files[file_name]
+                self._bodies.pop(file_name, None)
+                changed = True
+
+            if changed or not os.path.exists(self.index_path):
+                self._write_index()
+            self._build_lookups()
+
+    # Identical templates (same hash) are listed once, under the first file name
+    def _build_lookups(self):
+        self.by_name, self.by_hash, self.by_subjects = {}, {}, {}
+        for file_name in sorted(self.files):
+            entry = self.files[file_name]
+            if entry['hash'] in self.by_hash:
+                continue
+            name = os.path.splitext(file_name)[0]
+            self.by_hash[entry['hash']] = name
+            self.by_name[name] = file_name
+            self.by_subjects.setdefault(frozenset(entry['subjects']), []).append(name)
+
+    def names(self):
+        return list(self.by_name)
+
+    def summary(self, name):
+        return self.files[self.by_name[name]]
+
+    def find_by_subjects(self, subjects):
+        return list(self.by_subjects.get(frozenset(subjects), []))
+
+    # Preset body in the same shape as st.session_state.presets values
+    def get(self, name):
+        file_name = self.by_name[name]
+        if file_name not in self._bodies:
+            with open(os.path.join(self.preset_dir, file_name)) as f:
+                preset_data = json.load(f)
+            self._bodies[file_name] = {
+                'num_subjects': preset_data.get('num_subjects', 0),
+                'subjects': preset_data.get('subjects', []),
+                'hours': preset_data.get('hours', [])
+            }
+        return self._bodies[file_name]
+
+
+_registry = None
+
+
+# One registry per server process, shared by every session
+def get_registry():
+    global _registry
+    if _registry is None:
+        _registry = PresetRegistry()
+    else:
+        _registry.refresh()
+    return _registry
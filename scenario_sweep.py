@@ -0,0 +1,104 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from estimation import (COURSEWORK_WEIGHT, FINAL_MARK, draw_mistakes, expected_mistakes, grades_matrix,
+                        snapshot_weights)
+from instrumentation import timed
+
+# Largest number of 50-weighted subject sets swept at once
+MAX_SUBJECT_SETS = 4096
+
+# Grid points (mistake ranges) above which the sweep is split across processes
+POOL_RANGES = 256
+
+
+# Every (start, finish) mistake range with start < finish <= max_mistakes
+def mistake_ranges(max_mistakes, min_width=1):
+    return [(start, finish) for start in range(max_mistakes + 1)
+            for finish in range(start + min_width, max_mistakes + 1)]
+
+
+# Every subset of the candidate subjects made 50-weighted, on top of the
+# subjects that always are, as rows of a boolean (sets, subjects) matrix
+def subject_sets(subjects, candidates, always=()):
+    candidates = [subject for subject in candidates if subject in subjects and subject not in always]
+    if 2 ** len(candidates) > MAX_SUBJECT_SETS:
+        raise ValueError(f"{len(candidates)} candidate subjects give more than {MAX_SUBJECT_SETS} sets.")
+    base = np.isin(subjects, list(always))
+    index = {subject: i for i, subject in enumerate(subjects)}
+    masks, labels = [], []
+    for size in range(len(candidates) + 1):
+        for chosen in itertools.combinations(candidates, size):
+            mask = base.copy()
+            mask[[index[subject] for subject in chosen]] = True
+            masks.append(mask)
+            labels.append(', '.join(subject for subject in subjects if mask[index[subject]]) or 'None')
+    return np.array(masks, dtype=bool).reshape(len(masks), len(subjects)), labels
+
+
+# Seed of one grid point, the same whichever process evaluates it
+def range_seed(seed, start, finish):
+    return np.random.SeedSequence([seed, start, finish])
+
+
+# Final GPA = K(set) - sum(weight * mistakes), where K only depends on the
+# 50-weighted set and the mistakes only on the range. One set of draws per
+# range is sorted once and answers the goal question for every set.
+def _sweep_ranges(args):
+    ranges, hours, weights, constants, grade_goal, draws, seed = args
+    expected = np.empty((len(ranges), len(constants)))
+    probability = np.empty((len(ranges), len(constants)))
+    for i, (start, finish) in enumerate(ranges):
+        expected[i] = constants - weights @ expected_mistakes(start, finish, hours)
+        if draws:
+            rng = np.random.default_rng(range_seed(seed, start, finish))
+            lost = np.sort(draw_mistakes(start, finish, hours, draws, rng) @ weights)
+            probability[i] = np.searchsorted(lost, constants - grade_goal, side='right') / draws
+        else:
+            probability[i] = np.nan
+    return expected, probability
+
+
+# Expected final GPA and goal probability of one snapshot for every mistake
+# range (rows) and 50-weighted subject set (columns)
+def sweep_scenarios(grades, hours, ranges, masks, grade_goal, draws=10000, seed=0, workers=1):
+    grades = np.asarray(grades, dtype=float).reshape(1, -1)
+    hours = np.asarray(hours, dtype=float)
+    weights = snapshot_weights(grades, hours)[0]
+    coursework = np.where(masks, COURSEWORK_WEIGHT['f5'], COURSEWORK_WEIGHT['f4'])
+    full_marks = np.where(masks, FINAL_MARK['f5'], FINAL_MARK['f4'])
+    constants = ((np.nan_to_num(grades) / 100) * coursework + full_marks) @ weights
+
+    if workers > 1 and len(ranges) >= POOL_RANGES:
+        chunks = [list(chunk) for chunk in np.array_split(np.arange(len(ranges)), workers) if len(chunk)]
+        jobs = [([ranges[i] for i in chunk], hours, weights, constants, grade_goal, draws, seed)
+                for chunk in chunks]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_sweep_ranges, jobs))
+        expected = np.concatenate([result[0] for result in results])
+        probability = np.concatenate([result[1] for result in results])
+    else:
+        expected, probability = _sweep_ranges((ranges, hours, weights, constants, grade_goal, draws, seed))
+    return expected, probability
+
+
+# Heatmap-ready table for the latest snapshot (or another row): one line per
+# mistake range and 50-weighted set
+@timed
+def scenario_table(grades_data, hours_data, grade_goal, max_mistakes, candidates=None, always=(), draws=10000,
+                   seed=0, workers=1, row=-1):
+    subjects, grades, hours = grades_matrix(grades_data, hours_data)
+    masks, labels = subject_sets(subjects, subjects if candidates is None else candidates, always)
+    ranges = mistake_ranges(max_mistakes)
+    expected, probability = sweep_scenarios(grades[row], hours, ranges, masks, grade_goal, draws, seed, workers)
+
+    starts, finishes = np.array(ranges).reshape(-1, 2).T
+    return pd.DataFrame({
+        'Start': np.repeat(starts, len(labels)),
+        'Finish': np.repeat(finishes, len(labels)),
+        'Mistakes': np.repeat([f'{s}-{f}' for s, f in ranges], len(labels)),
+        '50-Weighted': np.tile(labels, len(ranges)),
+        'Expected GPA': expected.reshape(-1),
+        'Goal Probability': probability.reshape(-1),
+    })
@@ -0,0 +1,287 @@
+import contextlib
+import os
+import sqlite3
+import sys
+import threading
+import pandas as pd
+from grade_aggregates import empty_day, snapshot_day
+from grade_store import (DEFAULT_STUDENT, GRADES_CSV_PATH, MARKS_HOURS_CSV_PATH, evolve_header, history_files,
+                         read_csv_history)
+from instrumentation import count, timed
+
+SQLITE_PATH = os.environ.get('GPA_SQLITE_PATH', 'csv/grades.db')
+
+# One row per saved snapshot, one cell per column of that snapshot (subjects,
+# GPA, Total), so new subjects need no schema change. Every history file
+# path the app uses maps to one history name.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    history TEXT NOT NULL,
+    student TEXT NOT NULL DEFAULT '',
+    date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_student_date ON snapshots (history, student, date);
+CREATE INDEX IF NOT EXISTS snapshots_date ON snapshots (history, date);
+CREATE TABLE IF NOT EXISTS cells (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value,
+    PRIMARY KEY (snapshot_id, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cells_name ON cells (name, snapshot_id);
+"""
+
+# Idle connections kept per database for the next caller
+POOL_SIZE = 4
+
+_pool = {}
+_ready = set()
+_pool_lock = threading.Lock()
+_pool_pid = None
+_local = threading.local()
+
+
+def history_name(file_path):
+    return os.path.normpath(file_path)
+
+
+def _open(db_path):
+    directory = os.path.dirname(db_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    with _pool_lock:
+        ready = db_path in _ready
+    if not ready:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(SCHEMA)
+        with _pool_lock:
+            _ready.add(db_path)
+    return conn
+
+
+# A connection from the process-wide pool for the length of the block.
+# Streamlit runs every rerun on a new thread, so connections are not tied
+# to threads; the schema is set up once per process and database. Nested
+# blocks in a thread (has_history inside a save's transaction) share the
+# connection. WAL lets the dashboard read while another session is saving.
+@contextlib.contextmanager
+def connect(db_path=SQLITE_PATH):
+    global _pool_pid
+    held = getattr(_local, 'held', None)
+    if held is None or _local.pid != os.getpid():
+        held = _local.held = {}
+        _local.pid = os.getpid()
+    if db_path in held:
+        yield held[db_path]
+        return
+
+    with _pool_lock:
+        # Connections inherited from the parent of a fork are not reused
+        if _pool_pid != os.getpid():
+            _pool.clear()
+            _ready.clear()
+            _pool_pid = os.getpid()
+        idle = _pool.setdefault(db_path, [])
+        conn = idle.pop() if idle else None
+    if conn is None:
+        conn = _open(db_path)
+
+    held[db_path] = conn
+    try:
+        yield conn
+    finally:
+        del held[db_path]
+        with _pool_lock:
+            idle = _pool.setdefault(db_path, [])
+            if conn.in_transaction or len(idle) >= POOL_SIZE:
+                conn.close()
+            else:
+                idle.append(conn)
+
+
+def has_history(file_path, db_path=SQLITE_PATH):
+    with connect(db_path) as conn:
+        row = conn.execute('SELECT 1 FROM snapshots WHERE history = ? LIMIT 1',
+                           (history_name(file_path),)).fetchone()
+    return row is not None
+
+
+# WHERE clause picking the snapshots of a history, of one student unless None
+def _snapshots_of(file_path, student):
+    if student is None:
+        return 's.history = ?', [history_name(file_path)]
+    return 's.history = ? AND s.student = ?', [history_name(file_path), student]
+
+
+# Changes whenever a snapshot is added to the history (of the student)
+def history_version(file_path, student=None, db_path=SQLITE_PATH):
+    where, params = _snapshots_of(file_path, student)
+    with connect(db_path) as conn:
+        return conn.execute(f'SELECT COUNT(*), MAX(s.id) FROM snapshots s WHERE {where}', params).fetchone()
+
+
+# Plain Python values for sqlite3; missing cells are stored as NULL
+def _value(value):
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _insert(conn, history, record, student):
+    record = dict(record)
+    date = record.pop('Date/Time')
+    snapshot_id = conn.execute('INSERT INTO snapshots (history, student, date) VALUES (?, ?, ?)',
+                               (history, student, date)).lastrowid
+    conn.executemany('INSERT INTO cells (snapshot_id, position, name, value) VALUES (?, ?, ?, ?)',
+                     [(snapshot_id, position, name, _value(value))
+                      for position, (name, value) in enumerate(record.items())])
+
+
+def _import_csv(conn, file_path, student):
+    history = history_name(file_path)
+    for record in read_csv_history(file_path).to_dict('records'):
+        _insert(conn, history, record, student)
+
+
+# Save records (column -> value, with 'Date/Time') of a student (None for
+# DEFAULT_STUDENT) in one transaction. The first save of a history also
+# imports its CSV rows, as DEFAULT_STUDENT's, in the same transaction.
+@timed(name='sqlite_store.append_records')
+def append_records(file_path, records, student=None, db_path=SQLITE_PATH):
+    student = DEFAULT_STUDENT if student is None else student
+    with connect(db_path) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if not has_history(file_path, db_path) and history_files(file_path):
+                _import_csv(conn, file_path, DEFAULT_STUDENT)
+            for record in records:
+                _insert(conn, history_name(file_path), record, student)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+
+def append_record(file_path, record, student=None, db_path=SQLITE_PATH):
+    append_records(file_path, [record], student, db_path)
+
+
+# A history as the wide table the CSV files hold, ordered by save.
+# columns, start/end (inclusive 'YYYY-MM-DD' dates) and student are applied
+# in the query, so a date range or one subject reads only its rows.
+@timed(name='sqlite_store.load_history')
+def load_history(file_path, columns=None, start=None, end=None, student=None, db_path=SQLITE_PATH):
+    where, params = _snapshots_of(file_path, student)
+    where = [where]
+    if start is not None:
+        where.append('s.date >= ?')
+        params.append(str(start))
+    if end is not None:
+        where.append('s.date <= ?')
+        params.append(str(end))
+    join = 'LEFT JOIN cells c ON c.snapshot_id = s.id'
+    if columns is not None:
+        names = [c for c in columns if c != 'Date/Time']
+        join += f" AND c.name IN ({', '.join('?' * len(names))})"
+        params = names + params
+
+    with connect(db_path) as conn:
+        rows = conn.execute(
+            f"SELECT s.id, s.date, c.position, c.name, c.value FROM snapshots s {join} "
+            f"WHERE {' AND '.join(where)} ORDER BY s.id, c.position", params).fetchall()
+    count('cells_read', len(rows))
+    cells = pd.DataFrame(rows, columns=['id', 'Date/Time', 'position', 'name', 'value'], dtype=object)
+    dates = cells.drop_duplicates('id').set_index('id')['Date/Time']
+    cells = cells.dropna(subset=['name'])
+
+    # Same column order the CSV files get as subjects are added
+    header = evolve_header(['Date/Time'], list(cells['name'].drop_duplicates()))
+    if columns is not None:
+        header = [c for c in header if c in columns]
+
+    table = cells.pivot(index='id', columns='name', values='value').reindex(dates.index)
+    table.insert(0, 'Date/Time', dates)
+    table = table.reindex(columns=header).infer_objects().reset_index(drop=True)
+    table.columns.name = None
+    return table
+
+
+# Same shape as grade_aggregates.build_aggregates, computed by the database
+# over one student's snapshots (all if None)
+def aggregates(file_path, value_column, student=None, db_path=SQLITE_PATH):
+    where, params = _snapshots_of(file_path, student)
+    with connect(db_path) as conn:
+        count, total, low, high = conn.execute(
+            'SELECT COUNT(c.value), COALESCE(SUM(c.value), 0), MIN(c.value), MAX(c.value) FROM snapshots s '
+            f'JOIN cells c ON c.snapshot_id = s.id WHERE {where} AND c.name = ?',
+            params + [value_column]).fetchone()
+        subjects = conn.execute(
+            'SELECT c.name, COUNT(c.value), COALESCE(SUM(c.value), 0) FROM snapshots s '
+            f'JOIN cells c ON c.snapshot_id = s.id WHERE {where} AND c.name != ? GROUP BY c.name',
+            params + [value_column]).fetchall()
+
+        last = None
+        last_id = conn.execute(f'SELECT MAX(s.id) FROM snapshots s WHERE {where}', params).fetchone()[0]
+        if last_id is not None:
+            date = conn.execute('SELECT date FROM snapshots WHERE id = ?', (last_id,)).fetchone()[0]
+            last = {'Date/Time': date}
+            for name, value in conn.execute(
+                    'SELECT name, value FROM cells WHERE snapshot_id = ? ORDER BY position', (last_id,)):
+                last[name] = value
+
+    return {
+        'value_column': value_column,
+        'count': count,
+        'sum': float(total),
+        'min': low,
+        'max': high,
+        'last': last,
+        'subjects': {name: {'count': n, 'sum': float(s)} for name, n, s in subjects},
+        'fingerprint': None
+    }
+
+
+# Per-day totals in the layout of grade_aggregates.read_days, for trends.py
+def day_totals(file_path, value_column, student=None, db_path=SQLITE_PATH):
+    where, params = _snapshots_of(file_path, student)
+    days = {}
+    with connect(db_path) as conn:
+        rows = conn.execute(
+            'SELECT substr(s.date, 1, 10) AS day, c.name, COUNT(c.value), COALESCE(SUM(c.value), 0), '
+            'COALESCE(SUM(c.value * c.value), 0) FROM snapshots s JOIN cells c ON c.snapshot_id = s.id '
+            f'WHERE {where} GROUP BY day, c.name ORDER BY day', params).fetchall()
+    for day, name, n, s, squares in rows:
+        if not n or snapshot_day(day) is None:
+            continue
+        totals = days.setdefault(day, empty_day())
+        if name == value_column:
+            totals.update(count=n, sum=float(s), sumsq=float(squares))
+        else:
+            totals['subjects'][name] = [n, float(s)]
+    return days
+
+
+# Import the CSV histories once, e.g. before switching a deployment over
+def import_histories(file_paths, student=DEFAULT_STUDENT, db_path=SQLITE_PATH):
+    with connect(db_path) as conn:
+        for file_path in file_paths:
+            if has_history(file_path, db_path) or not history_files(file_path):
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                _import_csv(conn, file_path, student)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            print(f"{file_path} -> {db_path}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'import'
+    if command == 'import':
+        import_histories([GRADES_CSV_PATH, MARKS_HOURS_CSV_PATH])
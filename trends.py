@@ -0,0 +1,133 @@
+import datetime as dt
+import numpy as np
+import pandas as pd
+from instrumentation import timed
+
+# Days of history the rolling statistics, subject slopes and forecast look back over
+WINDOW_DAYS = 30
+
+# Final exam date when none is picked, this many days from today
+FINAL_EXAM_DAYS = 90
+
+
+def default_final_date(today=None):
+    return (today or dt.date.today()) + dt.timedelta(days=FINAL_EXAM_DAYS)
+
+
+# Per-day totals kept by grade_aggregates (current_days) as arrays ordered by
+# day. Saves only update the totals of their day, so everything below is
+# O(days) and never reads the history rows.
+def daily_totals(day_totals):
+    days = sorted(day_totals)
+    buckets = [day_totals[day] for day in days]
+    subjects = list(dict.fromkeys(subject for bucket in buckets for subject in bucket['subjects']))
+    subject_totals = np.array([[bucket['subjects'].get(subject, [0, 0.0]) for subject in subjects]
+                               for bucket in buckets], dtype=float).reshape(len(days), len(subjects), 2)
+    return {
+        'days': np.array(days, dtype='datetime64[D]'),
+        'ordinals': np.array([dt.date.fromisoformat(day).toordinal() for day in days], dtype=float),
+        'count': np.array([bucket['count'] for bucket in buckets], dtype=float),
+        'sum': np.array([bucket['sum'] for bucket in buckets], dtype=float),
+        'sumsq': np.array([bucket['sumsq'] for bucket in buckets], dtype=float),
+        'subjects': subjects,
+        'subject_count': subject_totals[:, :, 0],
+        'subject_sum': subject_totals[:, :, 1],
+    }
+
+
+# Sums over the window_days days ending at each day, via cumulative sums
+def _window_sums(ordinals, values, window_days):
+    first = np.searchsorted(ordinals, ordinals - window_days, side='right')
+    cumulative = np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+    return cumulative[1:] - cumulative[first]
+
+
+# Moving average and standard deviation of the value column (GPA) over the
+# snapshots of the last window_days days, one row per day with snapshots
+def rolling_stats(totals, window_days=WINDOW_DAYS):
+    count = _window_sums(totals['ordinals'], totals['count'], window_days)
+    total = _window_sums(totals['ordinals'], totals['sum'], window_days)
+    squares = _window_sums(totals['ordinals'], totals['sumsq'], window_days)
+    mean = np.divide(total, count, out=np.full_like(total, np.nan), where=count > 0)
+    variance = np.divide(squares - total * mean, count - 1, out=np.full_like(total, np.nan), where=count > 1)
+    return pd.DataFrame({
+        'Date': totals['days'],
+        'Snapshots': count.astype(int),
+        'Moving Average': mean,
+        'Rolling Std': np.sqrt(np.maximum(variance, 0)),
+    })
+
+
+# Least squares line through the (day, value) points of every snapshot,
+# from the per-day counts and sums. Days are counted from the last one.
+def _fit(days, count, total, squares=None):
+    n, t, tt = count.sum(axis=0), (days * count.T).T.sum(axis=0), (days ** 2 * count.T).T.sum(axis=0)
+    y, ty = total.sum(axis=0), (days * total.T).T.sum(axis=0)
+    spread = n * tt - t * t
+    slope = np.divide(n * ty - t * y, spread, out=np.zeros_like(y), where=spread > 1e-9)
+    intercept = np.divide(y - slope * t, n, out=np.full_like(y, np.nan), where=n > 0)
+    if squares is None:
+        return slope, intercept
+    # Residual standard deviation around the line
+    residual = squares.sum(axis=0) - intercept * y - slope * ty
+    residual_std = np.sqrt(np.maximum(residual, 0) / (n - 2)) if n > 2 else np.nan
+    return slope, intercept, residual_std
+
+
+def _last_window(totals, window_days):
+    if not len(totals['ordinals']):
+        return np.zeros(0, dtype=bool), np.zeros(0)
+    days = totals['ordinals'] - totals['ordinals'][-1]
+    return days > -window_days, days
+
+
+# Average and trend (points per day) of every subject over the last window
+def subject_slopes(totals, window_days=WINDOW_DAYS):
+    window, days = _last_window(totals, window_days)
+    count, total = totals['subject_count'][window], totals['subject_sum'][window]
+    slope, _ = _fit(days[window], count, total)
+    snapshots = count.sum(axis=0)
+    return pd.DataFrame({
+        'Subject': totals['subjects'],
+        'Snapshots': snapshots.astype(int),
+        'Average': np.divide(total.sum(axis=0), snapshots, out=np.full(len(snapshots), np.nan),
+                             where=snapshots > 0),
+        'Slope (per day)': slope,
+    })
+
+
+# Straight-line trend of the value column over the last window, carried on
+# to the final exam date, with a band of one residual standard deviation
+def forecast(totals, final_date, window_days=WINDOW_DAYS, low=0, high=100):
+    window, days = _last_window(totals, window_days)
+    if not window.any():
+        return None
+    slope, intercept, residual_std = _fit(days[window], totals['count'][window], totals['sum'][window],
+                                          totals['sumsq'][window])
+    if np.isnan(intercept):
+        return None
+    last_day = totals['days'][-1]
+    final_day = np.datetime64(final_date, 'D')
+    dates = np.array([last_day, max(final_day, last_day)])
+    values = np.clip(intercept + slope * (dates - last_day).astype(float), low, high)
+    spread = 0.0 if np.isnan(residual_std) else float(residual_std)
+    return {
+        'dates': dates,
+        'values': values,
+        'low': np.clip(values - spread, low, high),
+        'high': np.clip(values + spread, low, high),
+        'slope': float(slope),
+        'final': float(values[-1]),
+        'spread': spread,
+    }
+
+
+# Rolling statistics, subject slopes and forecast of one history
+@timed
+def trend_summary(day_totals, window_days=WINDOW_DAYS, final_date=None):
+    totals = daily_totals(day_totals)
+    return {
+        'rolling': rolling_stats(totals, window_days),
+        'slopes': subject_slopes(totals, window_days),
+        'forecast': forecast(totals, final_date or default_final_date(), window_days),
+    }